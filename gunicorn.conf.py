@@ -0,0 +1,58 @@
+"""
+Gunicorn settings of the service, read from the working directory
+
+The workers share their metrics through the files prometheus_client
+writes in PROMETHEUS_MULTIPROC_DIR. The directory is emptied when
+gunicorn starts so the counters of a previous run are not added to the
+new ones, and a temporary one is made, and removed on exit, when the
+variable is not set. The counters and histograms of a worker that exits
+are added to archive files so its files can be removed, and restarted
+workers do not leave files behind to be read on every scrape.
+"""
+import glob
+import os
+import shutil
+import tempfile
+
+METRIC_TYPES = ("counter", "histogram")
+
+created = []
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Gives the workers an empty metrics directory, before they are started"""
+    directory = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.db")):
+            os.remove(path)
+    else:
+        directory = tempfile.mkdtemp(prefix="service-metrics-")
+        created.append(directory)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Moves the metrics of a worker that exited to the archive files"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+    from prometheus_client.mmap_dict import MmapedDict  # pylint: disable=import-outside-toplevel
+
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    multiprocess.mark_process_dead(worker.pid, directory)
+    for kind in METRIC_TYPES:
+        path = os.path.join(directory, f"{kind}_{worker.pid}.db")
+        if not os.path.exists(path):
+            continue
+        archive = MmapedDict(os.path.join(directory, f"{kind}_archive.db"))
+        try:
+            for key, value, _ in MmapedDict.read_all_values_from_file(path):
+                archive.write_value(key, archive.read_value(key) + value)
+        finally:
+            archive.close()
+        os.remove(path)
+
+
+def on_exit(server):  # pylint: disable=unused-argument
+    """Removes the metrics directory made by on_starting"""
+    while created:
+        shutil.rmtree(created.pop(), ignore_errors=True)
@@ -56,7 +56,8 @@ api = Api(app,
 
 # Import the route After the Flask app is created
 # pylint: disable=wrong-import-position, cyclic-import
-from service import route, model, error_handlers  # noqa: F401, E402
+# metrics first, so its hooks time the others and see the final responses
+from service import metrics, route, model, error_handlers, commands, compression  # noqa: F401, E402
 
 # Set up logging for production
 print("Setting up logging for {}...".format(__name__))
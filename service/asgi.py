@@ -0,0 +1,303 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: asgi
+
+Optional ASGI entry point of the service, run it with:
+    uvicorn service.asgi:app
+
+The read endpoints that make up most of the traffic are served on the
+event loop with an async SQLAlchemy engine, so a worker keeps many
+requests waiting on the database at once. They build their queries with
+the model and their responses with the same helpers as the Flask routes,
+so the payloads are the same. Every other request, and any read the async
+path does not handle such as streams and field masks, is passed on to the
+Flask app, which runs in a thread pool.
+
+Needs the asgiref and asyncpg packages.
+"""
+import io
+import re
+import sys
+import logging
+from asgiref.wsgi import WsgiToAsgi
+from flask import Response, request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag
+from service.model import Supplier, Item, SupplierRecord, ItemRecord, DataValidationError
+from service.model import supplier_cache, item_cache, cache_key, version_statement, format_version
+from service import route
+from . import app as flask_app
+
+logger = logging.getLogger("flask.app")
+
+# Largest id of the Integer id columns, asyncpg refuses to send a larger one
+MAX_ID = 2 ** 31 - 1
+
+
+class PassOn(Exception):
+    """Raised by an async handler to hand its request over to the Flask app"""
+
+
+def async_database_uri(uri: str) -> str:
+    """Returns the URI of a PostgreSQL database for the asyncpg driver"""
+    scheme, rest = uri.split("://", 1)
+    if scheme.split("+")[0] not in ("postgres", "postgresql"):
+        raise ValueError(f"The async engine needs a PostgreSQL database, not {scheme}")
+    return f"postgresql+asyncpg://{rest}"
+
+
+def async_engine_options(config: dict) -> dict:
+    """Returns the options of the async engine's pool from the DB_POOL_* settings"""
+    return {
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+
+
+def wsgi_environ(scope: dict) -> dict:
+    """Returns the WSGI environ of a GET from its ASGI scope, as asgiref builds those it passes on"""
+    script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+    path_info = scope["path"].encode("utf8").decode("latin1")
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": script_name,
+        "PATH_INFO": path_info,
+        "QUERY_STRING": scope["query_string"].decode("ascii"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        # the GETs served on the event loop have no body
+        "wsgi.input": io.BytesIO(b""),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client") is not None:
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        if name not in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+            name = f"HTTP_{name}"
+        value = value.decode("latin1")
+        # repeated headers are joined with commas
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+######################################################################
+# Async Handlers
+######################################################################
+def check_unmasked():
+    """Passes requests with a field mask on to flask-restx, which applies it"""
+    if request.headers.get(flask_app.config["RESTX_MASK_HEADER"]):
+        raise PassOn()
+
+
+async def read_one(engine, model, record, cache, serializer, model_id):
+    """Returns a model by id through its cache, like find_cached() and the GET routes"""
+    check_unmasked()
+    key = cache_key(model_id)
+    if key > MAX_ID:
+        raise PassOn()
+    found, data = cache.get(key)
+    if not found:
+        table = model.__table__
+        statement = select(*(table.c[name] for name in record._fields)).where(table.c.id == key)
+        async with engine.connect() as connection:
+            row = (await connection.execute(statement)).first()
+        data = None if row is None else record._make(row).serialize()
+        cache.put(key, data)
+    if data is None:
+        # the Flask route answers the 404 from the cache just filled
+        raise PassOn()
+    row = record(**data)
+    etag = str(row.version)
+    response = route.not_modified(etag)
+    if response is not None:
+        return response
+    return Response(serializer.dumps_one(row), 200, {"ETag": quote_etag(etag)}, mimetype="application/json")
+
+
+async def read_page(engine, query, sort, args):
+    """Returns a page of Suppliers like route.supplier_page(), without streaming"""
+    check_unmasked()
+    if route.wants_stream():
+        raise PassOn()
+    limit = args['limit']
+    page = Supplier.keyset(query, sort=sort, cursor=args['cursor'])
+    rows = Supplier.project(page)
+    if limit:
+        rows = rows.limit(limit + 1)
+    async with engine.connect() as connection:
+        version = await connection.execute(version_statement(page, Supplier, limit + 1 if limit else None))
+        etag = format_version(version.one())
+        response = route.not_modified(etag)
+        if response is not None:
+            return response
+        suppliers = (await connection.execute(rows.statement)).all()
+    headers = {"ETag": quote_etag(etag)}
+    if limit:
+        suppliers, next_cursor = Supplier.cut_page(suppliers, sort, limit)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+    logger.info("Returning %d suppliers", len(suppliers))
+    return route.list_response(route.supplier_serializer, suppliers, headers)
+
+
+async def get_supplier(engine, supplier_id):
+    """GET /api/suppliers/{id}"""
+    return await read_one(engine, Supplier, SupplierRecord, supplier_cache, route.supplier_serializer, supplier_id)
+
+
+async def list_suppliers(engine):
+    """GET /api/suppliers"""
+    args = route.supplier_args.parse_args(strict=False)
+    return await read_page(engine, route.filtered_suppliers(args), args['sort'], args)
+
+
+async def list_suppliers_by_rating(engine):
+    """GET /api/suppliers/rating"""
+    args = route.rating_args.parse_args(strict=False)
+    return await read_page(engine, route.rated_suppliers(args), '-rating', args)
+
+
+async def get_item(engine, item_id):
+    """GET /api/items/{id}"""
+    return await read_one(engine, Item, ItemRecord, item_cache, route.item_serializer, item_id)
+
+
+async def list_items(engine):
+    """GET /api/items"""
+    route.stream_args.parse_args(strict=False)
+    check_unmasked()
+    if route.wants_stream():
+        raise PassOn()
+    async with engine.connect() as connection:
+        etag = format_version((await connection.execute(version_statement(Item.query, Item))).one())
+        response = route.not_modified(etag)
+        if response is not None:
+            return response
+        items = (await connection.execute(Item.project().statement)).all()
+    logger.info("Returning %d items", len(items))
+    return route.list_response(route.item_serializer, items, {"ETag": quote_etag(etag)})
+
+
+# GET paths served on the event loop, the strict_slashes=False of the Flask app included
+ROUTES = [
+    (re.compile(r"/api/suppliers/?"), list_suppliers),
+    (re.compile(r"/api/suppliers/rating/?"), list_suppliers_by_rating),
+    (re.compile(r"/api/suppliers/(\d+)/?"), get_supplier),
+    (re.compile(r"/api/items/?"), list_items),
+    (re.compile(r"/api/items/(\d+)/?"), get_item),
+]
+
+
+######################################################################
+# ASGI Application
+######################################################################
+class AsyncService:
+    """
+    Class that represents the service as an ASGI application
+
+    The async engine is created on first use, from the same settings as
+    the Flask app's engine, and disposed of at shutdown.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.passed_on = WsgiToAsgi(wsgi_app)
+        self._engine = None
+
+    @property
+    def engine(self):
+        """The async engine, created on first use"""
+        if self._engine is None:
+            config = self.wsgi_app.config
+            self._engine = create_async_engine(
+                async_database_uri(config["SQLALCHEMY_DATABASE_URI"]), **async_engine_options(config)
+            )
+        return self._engine
+
+    async def close(self):
+        """Closes the connections of the async engine"""
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["method"] == "GET":
+            for pattern, handler in ROUTES:
+                match = pattern.fullmatch(scope["path"])
+                if match:
+                    response = await self.serve(scope, handler, match.groups())
+                    if response is not None:
+                        await send_response(response, send)
+                        return
+                    break
+        await self.passed_on(scope, receive, send)
+
+    async def serve(self, scope, handler, params):
+        """Runs an async handler in a request context, None when it passes the request on"""
+        # an app context of its own gives each concurrent request its own g
+        with self.wsgi_app.app_context(), self.wsgi_app.request_context(wsgi_environ(scope)):
+            try:
+                # the before_request hooks time the request like any other
+                response = self.wsgi_app.preprocess_request() or await handler(self.engine, *params)
+            except (PassOn, HTTPException, DataValidationError):
+                # invalid args, cursors and the rest are answered by the Flask routes
+                return None
+            except Exception as error:  # pylint: disable=broad-except
+                # database errors are logged and answered by the JSON error handlers, as on the Flask routes
+                return self.wsgi_app.handle_exception(error)
+            # the after_request hooks compress the response like any other
+            return self.wsgi_app.process_response(response)
+
+    async def lifespan(self, receive, send):
+        """Answers the ASGI lifespan events, closing the engine at shutdown"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def send_response(response, send):
+    """Sends a Flask response through ASGI, then closes it as a WSGI server would"""
+    headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+    try:
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": response.get_data()})
+    finally:
+        response.close()
+
+
+app = AsyncService(flask_app)
@@ -0,0 +1,60 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: commands
+
+Flask CLI commands for database maintenance, run them with:
+    flask db-version
+    flask db-reset
+    flask db-check-indexes
+    flask db-reconcile-stats
+"""
+import click
+from service.model import db, reset_db, check_indexes, current_schema_version, reconcile_supplier_stats, SCHEMA_VERSION
+from . import app
+
+
+######################################################################
+# Database Commands
+######################################################################
+@app.cli.command("db-version")
+def db_version():
+    """Shows the version of the database schema"""
+    with db.engine.connect() as connection:
+        version = current_schema_version(connection)
+    click.echo(f"Database schema version {version}, latest is {SCHEMA_VERSION}")
+
+
+@app.cli.command("db-reset")
+@click.confirmation_option(prompt="This drops every table and all of their data. Continue?")
+def db_reset():
+    """Drops every table and recreates the database schema"""
+    reset_db()
+    click.echo(f"Database reset to schema version {SCHEMA_VERSION}")
+
+
+@app.cli.command("db-check-indexes")
+def db_check_indexes():
+    """Lists the declared indexes missing from the database and the unused ones"""
+    report = check_indexes()
+    click.echo("Missing indexes: " + (", ".join(report["missing"]) or "none"))
+    click.echo("Unused indexes: " + (", ".join(report["unused"]) or "none"))
+
+
+@app.cli.command("db-reconcile-stats")
+def db_reconcile_stats():
+    """Counts the Suppliers again and repairs the statistics kept by the database"""
+    with db.engine.begin() as connection:
+        drift = reconcile_supplier_stats(connection)
+    click.echo("Supplier statistics were off by: " + ", ".join(f"{name} {value}" for name, value in drift.items()))
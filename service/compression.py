@@ -0,0 +1,116 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: compression
+
+Compresses JSON responses with the best encoding the client accepts,
+gzip always and zstd or brotli when their packages are installed.
+Streamed responses are compressed as they are sent.
+"""
+import zlib
+from flask import request
+from . import app
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson")
+
+
+def gzip_compressor(level: int):
+    """Returns the compress and finish functions of a gzip stream"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def brotli_compressor(level: int):
+    """Returns the compress and finish functions of a brotli stream"""
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+
+
+def zstd_compressor(level: int):
+    """Returns the compress and finish functions of a zstd stream"""
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, compressor.flush
+
+
+# Content codings that can be used, with their compressor and the config of their level
+COMPRESSORS = {"gzip": (gzip_compressor, "COMPRESS_LEVEL")}
+if brotli is not None:
+    COMPRESSORS["br"] = (brotli_compressor, "COMPRESS_BROTLI_LEVEL")
+if zstandard is not None:
+    COMPRESSORS["zstd"] = (zstd_compressor, "COMPRESS_ZSTD_LEVEL")
+
+
+def etag_variants(etag: str) -> list:
+    """Returns an ETag and the ETags of its compressed representations"""
+    return [etag] + [f"{etag}-{coding}" for coding in COMPRESSORS]
+
+
+def choose_coding():
+    """Returns the preferred content coding the client accepts, or None"""
+    codings = [coding for coding in app.config["COMPRESS_ENCODINGS"] if coding in COMPRESSORS]
+    return request.accept_encodings.best_match(codings)
+
+
+def compress_stream(chunks, compress, finish):
+    """Compresses an iterable of chunks, yielding output as the compressor produces it"""
+    try:
+        for chunk in chunks:
+            data = compress(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8"))
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+######################################################################
+# Response Compression
+######################################################################
+@app.after_request
+def compress_response(response):
+    """Compresses JSON responses of at least COMPRESS_MIN_SIZE bytes"""
+    if (response.mimetype not in COMPRESSIBLE_TYPES or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or request.method == "HEAD" or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    coding = choose_coding()
+    if coding is None:
+        return response
+    if not response.is_streamed and response.calculate_content_length() < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    factory, level = COMPRESSORS[coding]
+    compress, finish = factory(app.config[level])
+    if response.is_streamed:
+        response.response = compress_stream(response.response, compress, finish)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compress(response.get_data()) + finish())
+    response.headers["Content-Encoding"] = coding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{coding}", weak)
+    return response
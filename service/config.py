@@ -12,5 +12,42 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker, which opens up to DB_POOL_SIZE + DB_MAX_OVERFLOW
+# connections: keep that times the workers of every replica below max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "yes", "1")
+
+# Optional comma separated URIs of read replicas: GET requests read from them in
+# turn, a replica that fails is left out for REPLICA_RETRY seconds, and a client
+# reads from the primary for REPLICA_READ_YOUR_WRITES seconds after it writes
+DATABASE_REPLICA_URIS = [uri for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri]
+REPLICA_RETRY = float(os.getenv("REPLICA_RETRY", "30"))
+REPLICA_READ_YOUR_WRITES = int(os.getenv("REPLICA_READ_YOUR_WRITES", "5"))
+
+# Number of rows written per statement by the batch endpoints
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "1000"))
+
+# Size and time to live in seconds of the per worker Supplier and Item caches
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+
+# Backend of /api/search: fulltext for the PostgreSQL full text indexes, memory for the
+# per worker word index. The word index and the name
+# index of autocomplete are rebuilt every SEARCH_INDEX_TTL seconds to pick up writes
+# made by other workers.
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "fulltext")
+SEARCH_INDEX_TTL = float(os.getenv("SEARCH_INDEX_TTL", "300"))
+
+# Responses of at least COMPRESS_MIN_SIZE bytes are compressed with the first of
+# COMPRESS_ENCODINGS the client accepts, zstd and br need their optional packages
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_ENCODINGS = os.getenv("COMPRESS_ENCODINGS", "zstd,br,gzip").split(",")
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BROTLI_LEVEL = int(os.getenv("COMPRESS_BROTLI_LEVEL", "4"))
+COMPRESS_ZSTD_LEVEL = int(os.getenv("COMPRESS_ZSTD_LEVEL", "3"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
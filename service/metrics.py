@@ -0,0 +1,174 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: metrics
+
+Metrics of the requests answered by every route, served at GET /metrics
+in the Prometheus text format by prometheus_client.
+
+Under gunicorn, gunicorn.conf.py sets PROMETHEUS_MULTIPROC_DIR and each
+worker writes its metrics to files there, which /metrics adds up in the
+multiprocess mode of prometheus_client, so any worker answers for all of
+them. Otherwise each process reports its own metrics.
+
+Outside production the number of SQL statements a request ran, and the
+time they took, are also sent back in its X-Query-Count and Server-Timing
+headers.
+"""
+import os
+import time
+from flask import Response, g, has_request_context, request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import generate_latest, multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from . import app
+
+# Upper bounds of the buckets of the time histograms in seconds, of the size histogram in bytes
+# and of the statement histogram
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 25, 50, 100)
+
+LABELS = ("method", "route")
+
+REQUESTS = Counter("http_requests_total", "Requests answered, by method, route and status", LABELS + ("status",))
+# livesum leaves out the workers that exited
+IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being answered, by method and route", LABELS,
+                    multiprocess_mode="livesum")
+DURATION = Histogram("http_request_duration_seconds", "Time taken to answer requests, by method and route", LABELS,
+                     buckets=TIME_BUCKETS)
+DB_TIME = Histogram("http_request_db_seconds", "Time requests spent running SQL statements, by method and route",
+                    LABELS, buckets=TIME_BUCKETS)
+DB_QUERIES = Histogram("http_request_db_queries", "SQL statements run by requests, by method and route", LABELS,
+                       buckets=QUERY_BUCKETS)
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Size of the response bodies, by method and route", LABELS,
+                          buckets=SIZE_BUCKETS)
+
+
+######################################################################
+# Request Hooks
+######################################################################
+def route_labels() -> dict:
+    """Returns the method and the URL rule of the request, without the ids it holds"""
+    return {"method": request.method, "route": request.url_rule.rule if request.url_rule else "unmatched"}
+
+
+def query_headers() -> bool:
+    """Returns True when the SQL statements of each request are reported in its headers"""
+    return app.testing or app.config.get("ENV", "production") != "production"
+
+
+def counted(chunks, size: list):
+    """Yields the chunks of a streamed body, adding up their size in bytes"""
+    try:
+        for chunk in chunks:
+            size[0] += len(chunk.encode() if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def observe(labels: dict, state, size: int):
+    """Records the time, database time, statements and size of a response once its body was sent"""
+    DURATION.labels(**labels).observe(time.perf_counter() - state.metrics_start)
+    DB_TIME.labels(**labels).observe(state.db_time)
+    DB_QUERIES.labels(**labels).observe(state.query_count)
+    if size is not None:
+        RESPONSE_SIZE.labels(**labels).observe(size)
+
+
+@app.before_request
+def start_request():
+    """Starts timing the request and counts it in progress"""
+    g.metrics_labels = route_labels()
+    g.metrics_start = time.perf_counter()
+    g.db_time = 0.0
+    g.query_count = 0
+    IN_PROGRESS.labels(**g.metrics_labels).inc()
+
+
+@app.after_request
+def record_request(response):
+    """Counts the response, and records its time, database time, statements and size when it is closed"""
+    labels = g.get("metrics_labels")
+    if labels is None:
+        return response
+    REQUESTS.labels(status=str(response.status_code), **labels).inc()
+    if query_headers():
+        # statements run while a streamed body is sent are not counted
+        response.headers["X-Query-Count"] = str(g.query_count)
+        response.headers["Server-Timing"] = f'db;dur={g.db_time * 1000:.3f};desc="{g.query_count} queries"'
+    # g outlives the request context of a streamed body, which is sent after this hook
+    state = g._get_current_object()  # pylint: disable=protected-access
+    if response.is_streamed:
+        size = [0]
+        response.response = counted(response.response, size)
+        response.call_on_close(lambda: observe(labels, state, size[0]))
+    else:
+        content_length = response.content_length
+        response.call_on_close(lambda: observe(labels, state, content_length))
+    return response
+
+
+@app.teardown_request
+def end_request(exception=None):  # pylint: disable=unused-argument
+    """Stops counting the request in progress"""
+    labels = g.pop("metrics_labels", None)
+    if labels is not None:
+        IN_PROGRESS.labels(**labels).dec()
+
+
+######################################################################
+# Database Time and Statements
+######################################################################
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument
+    """Notes when a statement of a request starts"""
+    if context is not None:
+        context.metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument
+    """Adds the time of a statement to its request, and counts it"""
+    start = getattr(context, "metrics_start", None)
+    if start is not None and has_request_context() and "db_time" in g:
+        g.db_time += time.perf_counter() - start
+        g.query_count += 1
+
+
+######################################################################
+# GET /metrics
+######################################################################
+def render() -> bytes:
+    """Returns the metrics of every process sharing PROMETHEUS_MULTIPROC_DIR, or of this one"""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest(REGISTRY)
+    try:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    except FileNotFoundError:
+        # gunicorn.conf.py removed the files of a worker that exited while they were read
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Metrics of the requests answered by every process, in the Prometheus text format"""
+    return Response(render(), content_type=CONTENT_TYPE_LATEST)
@@ -35,31 +35,357 @@ Attributes:
 id(int) - the id of the item
 name(string) - the name of the item
 """
+import json
+import math
+import base64
+import binascii
 import logging
+from collections import namedtuple
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, or_, bindparam, cast, column, create_engine, event, func, inspect, literal_column, select, text
+from sqlalchemy import tuple_, values, Numeric
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import NotFound
+from service.cache import LRUCache
+from service.pool import engine_options
+from service.replicas import RoutingSQLAlchemy, primary, replicas
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 # pylint: disable=no-member
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
+
+# Per worker caches of serialized Suppliers and Items by id, None marks an id that was not found
+supplier_cache = LRUCache()
+item_cache = LRUCache()
+
+# Per worker copies of the Suppliers and of the Items, such as the caches, which are told
+# through invalidate() of the ids written through the model and emptied by clear()
+supplier_copies = [supplier_cache]
+item_copies = [item_cache]
+
+# Text search configuration of the full text indexes, which only lowercases the words
+SEARCH_CONFIG = literal_column("'simple'")
 
 
 def init_db(app):
-    """Initialize the SQLAlchemy app"""
-    Supplier.init_db(app)
-    Item.init_db(app)
+    """Initialize the SQLAlchemy app and bring the schema up to date"""
+    logger.info("Initializing database")
+    # This is where we initialize SQLAlchemy from the Flask app
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+    db.init_app(app)
+    replicas.configure(
+        [create_engine(uri, **engine_options(dict(app.config, SQLALCHEMY_DATABASE_URI=uri)))
+         for uri in app.config.get("DATABASE_REPLICA_URIS", [])],
+        app.config.get("REPLICA_RETRY", 30.0),
+    )
+    app.app_context().push()
+    migrate()
+    check_indexes()
+    for cache in (supplier_cache, item_cache):
+        cache.configure(app.config.get("CACHE_SIZE", 10000), app.config.get("CACHE_TTL", 60.0))
+
+
+def reset_db():
+    """Drops every table and recreates the schema at the latest version"""
+    logger.warning("Dropping all tables")
+    db.session.remove()
+    db.drop_all()
+    migrate()
+    for copy in supplier_copies + item_copies:
+        copy.clear()
+
+
+def existing_indexes(connection) -> set:
+    """Returns the names of the indexes of our tables found in the database"""
+    # the inspector skips expression indexes such as the full text ones
+    rows = connection.execute(
+        text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename IN :tables").bindparams(
+            bindparam("tables", expanding=True)
+        ),
+        {"tables": list(db.metadata.tables)},
+    )
+    return {row[0] for row in rows}
+
+
+def check_indexes() -> dict:
+    """Reports the declared indexes missing from the database and the unused ones
+
+    Missing indexes are those declared on the models but not found in the
+    database. Unused indexes are those of our tables that PostgreSQL has
+    never scanned since its statistics were last reset.
+
+    :return: the names of the missing and of the unused indexes
+    :rtype: dict
+
+    """
+    tables = db.metadata.tables
+    missing = []
+    unused = []
+    with db.engine.connect() as connection:
+        existing = existing_indexes(connection)
+        for table in tables.values():
+            missing += sorted(index.name for index in table.indexes if index.name not in existing)
+
+        rows = connection.execute(
+            text(
+                "SELECT s.indexrelname FROM pg_stat_user_indexes s"
+                " JOIN pg_index i ON i.indexrelid = s.indexrelid"
+                " WHERE s.schemaname = current_schema() AND s.relname IN :tables"
+                " AND s.idx_scan = 0 AND NOT i.indisprimary"
+            ).bindparams(bindparam("tables", expanding=True)),
+            {"tables": list(tables)},
+        )
+        unused = sorted(row[0] for row in rows)
+
+    for name in missing:
+        logger.warning("Index %s is declared but missing from the database", name)
+    for name in unused:
+        logger.info("Index %s has not been used yet", name)
+    return {"missing": missing, "unused": unused}
 
 
 class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class VersionConflictError(Exception):
+    """Used when a Supplier was changed by someone else since it was read"""
+
+
+# Every schema version applied to the database, the current one is the highest
+schema_version = db.Table('schema_version',
+                          db.Column('version', db.Integer, primary_key=True),
+                          db.Column('applied_at', db.DateTime, nullable=False, server_default=func.now()))
+
+# Every write of a Supplier or an Item stamps the rows it changes with the next
+# value of this sequence, so a higher version is always a later change
+row_version = db.Sequence('row_version_seq', metadata=db.metadata)
+
+
+def stream(query, batch_size: int = 500):
+    """Iterates over the rows of a query through a server side cursor
+
+    Only batch_size rows are held in memory at a time, however many the
+    query returns.
+    """
+    return query.execution_options(stream_results=True).yield_per(batch_size)
+
+
+class SupplierRecord(namedtuple("SupplierRecord", "id name available address rating version")):
+    """A read-only Supplier row, without the ORM bookkeeping of a Supplier"""
+    __slots__ = ()
+
+    def serialize(self) -> dict:
+        """Serializes a SupplierRecord into a dictionary like Supplier.serialize()"""
+        return self._asdict()
+
+
+class ItemRecord(namedtuple("ItemRecord", "id name version")):
+    """A read-only Item row, without the ORM bookkeeping of an Item"""
+    __slots__ = ()
+
+    def serialize(self) -> dict:
+        """Serializes an ItemRecord into a dictionary like Item.serialize()"""
+        return self._asdict()
+
+
+def project(query, model, record):
+    """Narrows a query of a model down to the columns of a record, in its order
+
+    The query then returns plain rows, which are neither put in the
+    session's identity map nor tracked for changes.
+    """
+    return query.with_entities(*(getattr(model, name) for name in record._fields))
+
+
+def fetch_records(query, model, record) -> list:
+    """Returns the rows of a query of a model as records"""
+    return list(map(record._make, db.session.execute(project(query, model, record).statement)))
+
+
+def cache_key(model_id):
+    """Returns the integer id used as cache key, or None for an invalid id"""
+    try:
+        return int(model_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def find_cached(cls, cache: LRUCache, model_id):
+    """Finds a model by its id through a cache of its serialized form
+
+    A cached model is attached to the session without querying the
+    database. Ids that were not found are cached too. Misses are read from
+    the primary, as a copy read from a lagging replica would outlive the lag.
+    """
+    key = cache_key(model_id)
+    if key is None:
+        return cls.query.get(model_id)
+    found, data = cache.get(key)
+    if found:
+        if data is None:
+            return None
+        instance = cls(**data)
+        make_transient_to_detached(instance)
+        return db.session.merge(instance, load=False)
+    with primary():
+        instance = cls.query.get(key)
+    cache.put(key, None if instance is None else instance.serialize())
+    return instance
+
+
+def suppliers_changed(*ids):
+    """Tells the per worker copies of the Suppliers that these were written"""
+    for copy in supplier_copies:
+        copy.invalidate(*ids)
+
+
+def items_changed(*ids):
+    """Tells the per worker copies of the Items that these were written"""
+    for copy in item_copies:
+        copy.invalidate(*ids)
+
+
+def invalidate_relations(pairs: list):
+    """Tells the copies of the Suppliers and Items of changed relations"""
+    suppliers_changed(*{pair[0] for pair in pairs})
+    items_changed(*{pair[1] for pair in pairs})
+
+
+def search_vector(*columns):
+    """Returns the full text search vector of the words of some text columns"""
+    text_value = columns[0]
+    for column_value in columns[1:]:
+        text_value = text_value + literal_column("' '") + column_value
+    return func.to_tsvector(SEARCH_CONFIG, text_value)
+
+
+def search_records(model, record, words: list, limit: int) -> list:
+    """Returns the records of a model whose SEARCH_KEYS hold words starting with each word
+
+    The match uses the full text index of the model. The best ranked
+    records come first, then those with the lowest ids.
+    """
+    vector = search_vector(*(getattr(model, name) for name in model.SEARCH_KEYS))
+    query = func.to_tsquery(SEARCH_CONFIG, " & ".join(f"{word}:*" for word in words))
+    matches = model.query.filter(vector.op("@@")(query))
+    return fetch_records(
+        matches.order_by(func.ts_rank(vector, query).desc(), model.id).limit(limit), model, record
+    )
+
+
+def query_version(query, model, limit: int = None) -> str:
+    """Returns a version of the rows of a query that changes whenever they do
+
+    Computed from the count, highest and sum of the row versions with one
+    aggregate query, without loading any row. The sum catches writes that
+    commit out of version order. Given a limit only the first rows of the
+    ordered query are aggregated, so a page costs as much as its rows.
+
+    :param query: the query of the rows
+    :param model: the model of the rows, Supplier or Item
+    :param limit: the number of rows to aggregate, None for all of them
+
+    :return: the version of the rows
+    :rtype: str
+
+    """
+    return format_version(db.session.execute(version_statement(query, model, limit)).one())
+
+
+def version_statement(query, model, limit: int = None):
+    """Returns the aggregate statement of query_version(), to run on any connection"""
+    if limit is None:
+        return query.order_by(None).with_entities(
+            func.count(model.id), func.max(model.version), func.sum(model.version)
+        ).statement
+    rows = query.with_entities(model.id, model.version).limit(limit).subquery()
+    return select(func.count(rows.c.id), func.max(rows.c.version), func.sum(rows.c.version))
+
+
+def format_version(row) -> str:
+    """Formats the count, highest and sum of the row versions from version_statement()"""
+    count, highest, total = row
+    return f"{count}-{highest or 0}-{total or 0}"
+
+
+def encode_cursor(sort: str, values: list) -> str:
+    """Encodes the sort key and the last row's key values into an opaque cursor"""
+    payload = json.dumps({"sort": sort, "after": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+# Types of the values a cursor holds for each sort key, ending with the id tie breaker
+CURSOR_TYPES = {"id": [int], "name": [str, int], "rating": [(int, float), int]}
+
+
+def decode_cursor(sort: str, cursor: str) -> list:
+    """Decodes a cursor made by encode_cursor() for the same sort key"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        after = payload["after"]
+        if payload["sort"] != sort:
+            raise DataValidationError("Cursor does not match sort order: " + sort)
+    except (ValueError, TypeError, KeyError, binascii.Error) as error:
+        raise DataValidationError("Invalid cursor: " + cursor) from error
+    types = CURSOR_TYPES[sort.lstrip("-")]
+    if not isinstance(after, list) or len(after) != len(types) or not all(
+            isinstance(value, kind) and not isinstance(value, bool) for value, kind in zip(after, types)):
+        raise DataValidationError("Invalid cursor: " + cursor)
+    return after
+
+
 supplier_item = db.Table('supplier_to_item',
                          db.Column('supplier_id', db.Integer, db.ForeignKey(
                              'supplier.id', ondelete='CASCADE'), primary_key=True),
-                         db.Column('item_id', db.Integer, db.ForeignKey('item.id', ondelete='CASCADE'), primary_key=True))
+                         db.Column('item_id', db.Integer, db.ForeignKey('item.id', ondelete='CASCADE'), primary_key=True),
+                         # the primary key only serves lookups by supplier, this one serves lookups by item
+                         db.Index('ix_supplier_to_item_item_id', 'item_id', 'supplier_id'))
+
+
+def list_related(parent, parent_id: int, limit: int = None, cursor: str = None):
+    """Returns a page of the Items of a Supplier or of the Suppliers of an Item
+
+    A single query left joins the parent to its relations, so a missing
+    parent is told apart from one without relations in the same round trip,
+    and only the columns of the related table are fetched, without building
+    model instances.
+
+    :return: the rows of the page and the cursor of the next page
+    :rtype: tuple
+
+    """
+    child = Item if parent is Supplier else Supplier
+    parent_key, child_key = (
+        (supplier_item.c.supplier_id, supplier_item.c.item_id) if parent is Supplier
+        else (supplier_item.c.item_id, supplier_item.c.supplier_id)
+    )
+    related = parent_key == parent.id
+    if cursor:
+        related = and_(related, child_key > decode_cursor("id", cursor)[0])
+    query = (
+        db.session.query(parent.id.label("parent_id"), *child.__table__.columns)
+        .select_from(parent)
+        .outerjoin(supplier_item, related)
+        .outerjoin(child, child.id == child_key)
+        .filter(parent.id == parent_id)
+        .order_by(child_key)
+    )
+    if limit is not None:
+        query = query.limit(limit + 1)
+    rows = query.all()
+    if not rows:
+        raise NotFound(f"{parent.__name__} with id '{parent_id}' was not found.")
+    rows = [row for row in rows if row.id is not None]
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor("id", [rows[-1].id])
 
 
 class Supplier(db.Model):
@@ -74,11 +400,17 @@ class Supplier(db.Model):
     # Table Schema
     ##################################################
     __tablename__ = 'supplier'
+    # columns a list of Suppliers can be sorted on, prefix with '-' for descending
+    SORT_KEYS = ("id", "name", "rating")
+    # columns whose words search() matches
+    SEARCH_KEYS = ("name", "address")
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(63), nullable=False)
     available = db.Column(db.Boolean(), nullable=False, default=False)
     address = db.Column(db.String(63), nullable=False)
     rating = db.Column(db.Float, nullable=False)
+    version = db.Column(db.BigInteger, nullable=False, server_default=row_version.next_value())
 
     supplier_to_item = db.relationship('Item',
                                        secondary=supplier_item,
@@ -86,6 +418,22 @@ class Supplier(db.Model):
                                        cascade='all',
                                        passive_deletes=True)
 
+    # Indexes for the find_by_* finders, ending with the id so they also
+    # serve the keyset ordering of paginate()
+    __table_args__ = (
+        db.Index('ix_supplier_name', name, id),
+        db.Index('ix_supplier_address', address),
+        db.Index('ix_supplier_rating', rating.desc(), id),
+        db.Index('ix_supplier_available', id,
+                 postgresql_where=text('available')),
+        # full text index of search()
+        db.Index('ix_supplier_search', search_vector(name, address), postgresql_using='gin'),
+    )
+
+    # UPDATE and DELETE only match the row at the version it was read at,
+    # update() sets the next version itself
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
+
     ##################################################
     # INSTANCE METHODS
     ##################################################
@@ -102,21 +450,43 @@ class Supplier(db.Model):
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
         db.session.commit()
+        suppliers_changed(self.id)
 
     def update(self):
         """
         Updates a Supplier to the database
+
+        Raises VersionConflictError, without writing anything, when the
+        Supplier was changed by someone else since it was read
         """
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        db.session.commit()
+        supplier_id = cache_key(self.id)
+        self.version = row_version.next_value()
+        self._commit(supplier_id)
 
     def delete(self):
-        """Removes a Supplier from the data store"""
+        """Removes a Supplier from the data store
+
+        Raises VersionConflictError, without removing it, when the Supplier
+        was changed by someone else since it was read
+        """
         logger.info("Deleting %s", self.name)
+        supplier_id = cache_key(self.id)
         db.session.delete(self)
-        db.session.commit()
+        self._commit(supplier_id)
+
+    @staticmethod
+    def _commit(supplier_id: int):
+        """Commits a write of a Supplier read at a version that must still be current"""
+        try:
+            db.session.commit()
+        except StaleDataError as error:
+            db.session.rollback()
+            raise VersionConflictError(f"Supplier with id '{supplier_id}' was changed by another request") from error
+        finally:
+            suppliers_changed(supplier_id)
 
     def serialize(self) -> dict:
         """Serializes a Supplier into a dictionary"""
@@ -125,7 +495,8 @@ class Supplier(db.Model):
             "name": self.name,
             "available": self.available,
             "address": self.address,
-            "rating": self.rating
+            "rating": self.rating,
+            "version": self.version,
         }
 
     def deserialize(self, data: dict):
@@ -151,6 +522,9 @@ class Supplier(db.Model):
                 )
             if isinstance(float(data["rating"]), float):
                 self.rating = float(data["rating"])
+                # NaN and infinite ratings would break the sums of the statistics for good
+                if not math.isfinite(self.rating):
+                    raise DataValidationError("Invalid value for float [rating]: " + str(data["rating"]))
             else:
                 raise DataValidationError(
                     "Invalid type for float [rating]: " +
@@ -167,6 +541,10 @@ class Supplier(db.Model):
         except KeyError as error:
             raise DataValidationError(
                 "Invalid supplier: missing " + error.args[0]) from error
+        except ValueError as error:
+            raise DataValidationError(
+                "Invalid value for float [rating]: " + str(error)
+            ) from error
         except TypeError as error:
             raise DataValidationError(
                 "Invalid supplier: body of request contained bad or no data " +
@@ -186,12 +564,175 @@ class Supplier(db.Model):
         :type data: Flask
 
         """
-        logger.info("Initializing database")
-        # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
-        app.app_context().push()
-        db.drop_all()
-        db.create_all()  # make our sqlalchemy tables
+        init_db(app)
+
+    @classmethod
+    def create_many(cls, suppliers: list, chunk_size: int = 1000) -> list:
+        """Creates Suppliers with one multi-row INSERT ... RETURNING per chunk
+
+        Each chunk is committed on its own. When the database rejects a chunk
+        its rows are retried one at a time so only the bad ones fail. The
+        order of the rows of RETURNING is not guaranteed, so each row is
+        given its id before the INSERT, along with its position in the chunk,
+        and the statement returns both.
+
+        :param suppliers: the Suppliers to create
+        :type suppliers: list
+        :param chunk_size: the number of rows per INSERT statement
+        :type chunk_size: int
+
+        :return: for each Supplier its new id, or the error that stopped it
+        :rtype: list
+
+        """
+        logger.info("Creating %d Suppliers in chunks of %d", len(suppliers), chunk_size)
+        table = cls.__table__
+        statement = table.insert().returning(table.c.id)
+        keys = ("name", "available", "address", "rating")
+        results = []
+        for start in range(0, len(suppliers), chunk_size):
+            chunk = suppliers[start:start + chunk_size]
+            rows = [
+                {key: value for key, value in supplier.serialize().items() if key not in ("id", "version")}
+                for supplier in chunk
+            ]
+            try:
+                ordinals = dict(db.session.execute(cls._insert_ordered(keys, rows)).all())
+                ids = [ordinals[ordinal] for ordinal in range(len(rows))]
+                db.session.commit()
+            except DBAPIError:
+                db.session.rollback()
+                ids = []
+                for row in rows:
+                    try:
+                        ids.append(db.session.execute(statement.values(row)).scalar())
+                        db.session.commit()
+                    except DBAPIError as error:
+                        db.session.rollback()
+                        # the text of the driver holds the SQL, it is logged rather than answered
+                        logger.warning("Supplier rejected by the database: %s", str(error.orig).strip())
+                        ids.append(DataValidationError("Invalid supplier: rejected by the database"))
+            for supplier, supplier_id in zip(chunk, ids):
+                if not isinstance(supplier_id, Exception):
+                    supplier.id = supplier_id
+                    suppliers_changed(supplier_id)
+            results += ids
+        return results
+
+    @classmethod
+    def _insert_ordered(cls, keys: tuple, rows: list):
+        """Returns an INSERT of rows answering the position of each row with its new id"""
+        table = cls.__table__
+        chunk = values(column("ordinal", db.Integer), *(column(key, table.c[key].type) for key in keys), name="chunk")
+        chunk = chunk.data([(ordinal,) + tuple(row[key] for key in keys) for ordinal, row in enumerate(rows)])
+        # a CTE calling nextval() is run once, so each row keeps the id it is given
+        numbered = select(
+            func.nextval(func.pg_get_serial_sequence(table.name, "id")).label("id"), *chunk.c
+        ).cte("numbered")
+        inserted = (
+            table.insert()
+            .from_select(["id", *keys], select(numbered.c.id, *(numbered.c[key] for key in keys)))
+            .returning(table.c.id)
+            .cte("inserted")
+        )
+        return select(numbered.c.ordinal, inserted.c.id).join(inserted, inserted.c.id == numbered.c.id)
+
+    @classmethod
+    def validate_patch(cls, data: dict) -> dict:
+        """Checks the attributes of a partial update of a Supplier
+
+        :param data: some of the Supplier attributes, with the same types
+                     as those accepted by deserialize()
+        :type data: dict
+
+        :return: the attributes to set
+        :rtype: dict
+
+        """
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid patch: body of request contained bad or no data")
+        patch = {}
+        for key, value in data.items():
+            if key in ("name", "address") and isinstance(value, str):
+                length = cls.__table__.c[key].type.length
+                if length and len(value) > length:
+                    raise DataValidationError(f"Invalid [{key}]: longer than {length} characters")
+                patch[key] = value
+            elif key == "available" and isinstance(value, bool):
+                patch[key] = value
+            elif key == "rating" and isinstance(value, (int, float)) and not isinstance(value, bool):
+                if not math.isfinite(value):
+                    raise DataValidationError(f"Invalid value for float [rating]: {value}")
+                patch[key] = float(value)
+            elif key in ("name", "address", "available", "rating"):
+                raise DataValidationError(f"Invalid type for [{key}]: " + str(type(value)))
+            else:
+                raise DataValidationError(f"Invalid patch: unknown attribute {key}")
+        if not patch:
+            raise DataValidationError("Invalid patch: no attribute to update")
+        return patch
+
+    @classmethod
+    def update_many(cls, patches: dict) -> list:
+        """Updates many Suppliers in one transaction
+
+        Suppliers receiving the same patch are updated by a single
+        UPDATE ... WHERE id IN (...) statement.
+
+        :param patches: the patch from validate_patch() of each Supplier id
+        :type patches: dict
+
+        :return: the ids of the Suppliers that were updated
+        :rtype: list
+
+        :raises DataValidationError: when the database rejects the patches,
+                                     none of which are applied then
+
+        """
+        logger.info("Updating %d Suppliers", len(patches))
+        groups = {}
+        for supplier_id, patch in patches.items():
+            groups.setdefault(tuple(sorted(patch.items())), []).append(supplier_id)
+        table = cls.__table__
+        updated = []
+        try:
+            for patch, ids in groups.items():
+                statement = table.update().where(table.c.id.in_(ids)).values(
+                    dict(patch, version=row_version.next_value())).returning(table.c.id)
+                updated += db.session.execute(statement).scalars().all()
+            db.session.commit()
+        except DBAPIError as error:
+            db.session.rollback()
+            logger.warning("Patch rejected by the database: %s", str(error.orig).strip())
+            raise DataValidationError("Invalid patch: rejected by the database") from error
+        suppliers_changed(*updated)
+        return sorted(updated)
+
+    @classmethod
+    def delete_many(cls, ids: list) -> list:
+        """Removes many Suppliers with a single DELETE ... WHERE id IN (...)
+
+        :param ids: the ids of the Suppliers to remove
+        :type ids: list
+
+        :return: the ids of the Suppliers that were removed
+        :rtype: list
+
+        :raises DataValidationError: when the database rejects the ids
+
+        """
+        logger.info("Deleting %d Suppliers", len(ids))
+        table = cls.__table__
+        statement = table.delete().where(table.c.id.in_(ids)).returning(table.c.id)
+        try:
+            deleted = db.session.execute(statement).scalars().all()
+            db.session.commit()
+        except DBAPIError as error:
+            db.session.rollback()
+            logger.warning("Ids rejected by the database: %s", str(error.orig).strip())
+            raise DataValidationError("Invalid ids: rejected by the database") from error
+        suppliers_changed(*deleted)
+        return sorted(deleted)
 
     @classmethod
     def all(cls) -> list:
@@ -200,18 +741,44 @@ class Supplier(db.Model):
         return cls.query.all()
 
     @classmethod
-    def find(cls, supplier_id: int):
+    def project(cls, query=None):
+        """Narrows a Supplier query, all Suppliers if None, down to the columns of a SupplierRecord"""
+        return project(cls.query if query is None else query, cls, SupplierRecord)
+
+    @classmethod
+    def records(cls, query=None) -> list:
+        """Returns the Suppliers of a query as read-only SupplierRecords
+
+        Only the columns are fetched and no Supplier is loaded in the session,
+        which makes listing cheaper, e.g. Supplier.records(Supplier.find_by_name(name))
+
+        :param query: the Supplier query to read, all Suppliers if None
+
+        :return: a SupplierRecord for each Supplier of the query
+        :rtype: list
+
+        """
+        logger.info("Processing Supplier records")
+        return fetch_records(cls.query if query is None else query, cls, SupplierRecord)
+
+    @classmethod
+    def find(cls, supplier_id: int, cache: bool = True):
         """Finds a supplier by it's ID
 
         :param supplier_id: the id of the Supplier to find
         :type supplier_id: int
+        :param cache: False to read the Supplier from the database,
+                      as done before changing it
+        :type cache: bool
 
         :return: an instance with the supplier_id, or None if not found
         :rtype: Supplier
 
         """
         logger.info("Processing lookup for id %s ...", supplier_id)
-        return cls.query.get(supplier_id)
+        if not cache:
+            return cls.query.get(supplier_id)
+        return find_cached(cls, supplier_cache, supplier_id)
 
     @classmethod
     def find_or_404(cls, supplier_id: int):
@@ -228,84 +795,346 @@ class Supplier(db.Model):
         return cls.query.get_or_404(supplier_id)
 
     @classmethod
-    def find_by_name(cls, name: str) -> list:
+    def find_by_name(cls, name: str, query=None) -> list:
         """Returns all Suppliers with the given name
 
         :param name: the name of the Suppliers you want to match
         :type name: str
+        :param query: the Supplier query to narrow down, all Suppliers if None
 
         :return: a collection of Suppliers with that name
         :rtype: list
 
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        return (cls.query if query is None else query).filter(cls.name == name)
 
     @classmethod
-    def find_by_address(cls, address: str) -> list:
+    def find_by_address(cls, address: str, query=None) -> list:
         """Returns all Suppliers with the given address
 
         :param address: the address of the Suppliers you want to match
         :type address: str
+        :param query: the Supplier query to narrow down, all Suppliers if None
 
         :return: a collection of Suppliers with that address
         :rtype: list
 
         """
         logger.info("Processing address query for %s ...", address)
-        return cls.query.filter(cls.address == address)
+        return (cls.query if query is None else query).filter(cls.address == address)
 
     @classmethod
-    def find_by_rating(cls, rating: float) -> list:
-        """Returns all Suppliers with the given rating
+    def find_by_rating(cls, rating: float, query=None) -> list:
+        """Returns all Suppliers with the given rating or higher
 
-        :param rating: the rating of the Suppliers you want to match
+        :param rating: the minimum rating of the Suppliers you want to match
         :type rating: float
+        :param query: the Supplier query to narrow down, all Suppliers if None
 
         :return: a collection of Suppliers with that rating
         :rtype: list
 
         """
         logger.info("Processing rating query for %s ...", rating)
-        return cls.query.filter(cls.rating >= rating)
+        return (cls.query if query is None else query).filter(cls.rating >= rating)
+
+    @classmethod
+    def find_by_max_rating(cls, rating: float, query=None) -> list:
+        """Returns all Suppliers with the given rating or lower
+
+        :param rating: the maximum rating of the Suppliers you want to match
+        :type rating: float
+        :param query: the Supplier query to narrow down, all Suppliers if None
+
+        :return: a collection of Suppliers with that rating or lower
+        :rtype: list
+
+        """
+        logger.info("Processing max rating query for %s ...", rating)
+        return (cls.query if query is None else query).filter(cls.rating <= rating)
+
+    @classmethod
+    def find_by_item(cls, item_id: int, query=None):
+        """Returns all Suppliers related to the given Item
+
+        :param item_id: the id of the Item whose Suppliers you want
+        :type item_id: int
+        :param query: the Supplier query to narrow down, all Suppliers if None
+
+        :return: a collection of Suppliers of that Item
+        :rtype: list
+
+        """
+        logger.info("Processing item query for %s ...", item_id)
+        query = cls.query if query is None else query
+        return query.join(supplier_item).filter(supplier_item.c.item_id == item_id)
+
+    @classmethod
+    def find_by_filters(cls, item_id: int = None, name: str = None, address: str = None,
+                        available: bool = None, rating: float = None, max_rating: float = None):
+        """Returns the Suppliers matching all of the given filters
+
+        Filters left as None are ignored, the others are ANDed into a single
+        query. The item join comes first so it is driven by the item index,
+        then the equality filters on indexed columns, and the rating range last.
+
+        :return: a collection of Suppliers matching every filter
+        :rtype: list
+
+        """
+        query = cls.query
+        if item_id is not None:
+            query = cls.find_by_item(item_id, query)
+        if name is not None:
+            query = cls.find_by_name(name, query)
+        if address is not None:
+            query = cls.find_by_address(address, query)
+        if available is not None:
+            query = cls.find_by_availability(available, query)
+        if rating is not None:
+            query = cls.find_by_rating(rating, query)
+        if max_rating is not None:
+            query = cls.find_by_max_rating(max_rating, query)
+        return query
+
+    @classmethod
+    def keyset(cls, query=None, sort: str = "id", cursor: str = None):
+        """Orders a Supplier query for keyset pagination
+
+        Rows are ordered by the sort column with the id as a tie breaker and,
+        given a cursor, start strictly after the row encoded in it.
+
+        :param query: the Supplier query to order, all Suppliers if None
+        :param sort: one of SORT_KEYS, prefixed with '-' for descending order
+        :param cursor: the cursor returned with the previous page
+
+        :return: the ordered query
+        :rtype: Query
+
+        """
+        if query is None:
+            query = cls.query
+        key = sort.lstrip("-")
+        descending = sort.startswith("-")
+        if key not in cls.SORT_KEYS:
+            raise DataValidationError("Invalid sort key: " + sort)
+        column = getattr(cls, key)
+
+        if cursor:
+            after = decode_cursor(sort, cursor)
+            if key == "id":
+                query = query.filter(cls.id < after[0] if descending else cls.id > after[0])
+            else:
+                beyond = column < after[0] if descending else column > after[0]
+                query = query.filter(or_(beyond, and_(column == after[0], cls.id > after[1])))
+
+        if key == "id":
+            return query.order_by(cls.id.desc() if descending else cls.id)
+        return query.order_by(column.desc() if descending else column, cls.id)
+
+    @classmethod
+    def paginate(cls, query=None, sort: str = "id", limit: int = None, cursor: str = None):
+        """Returns one page of Suppliers using keyset pagination
+
+        A page starts strictly after the row encoded in the cursor, so the cost
+        of a page depends on its size rather than on how deep into the list it is.
+
+        :param query: the Supplier query to paginate, all Suppliers if None
+        :param sort: one of SORT_KEYS, prefixed with '-' for descending order
+        :param limit: the maximum number of Suppliers to return, None for all
+        :param cursor: the cursor returned with the previous page
+
+        :return: the Suppliers of the page and the cursor of the next page,
+                 or None when this is the last page
+        :rtype: tuple
+
+        """
+        query = cls.keyset(query, sort, cursor)
+        if limit is None:
+            return query.all(), None
+        logger.info("Processing page of %s Suppliers sorted by %s ...", limit, sort)
+        return cls.cut_page(query.limit(limit + 1).all(), sort, limit)
+
+    @classmethod
+    def cut_page(cls, suppliers: list, sort: str, limit: int):
+        """Returns a page from its first limit + 1 Suppliers, and the cursor of the next page if any"""
+        if len(suppliers) <= limit:
+            return suppliers, None
+        suppliers = suppliers[:limit]
+        last = suppliers[-1]
+        key = sort.lstrip("-")
+        values = [last.id] if key == "id" else [getattr(last, key), last.id]
+        return suppliers, encode_cursor(sort, values)
+
+    @classmethod
+    def facets(cls, query=None, bucket: float = 1.0) -> dict:
+        """Counts the Suppliers of a query by availability and by rating bucket
+
+        A single aggregate groups the Suppliers by bucket, counting the
+        available ones of each with a FILTER, so no row is loaded.
+
+        :param query: the Supplier query to count, all Suppliers if None
+        :param bucket: the width of the rating buckets, each starting at a multiple of it
+        :type bucket: float
+
+        :return: the total, the counts by availability and the non-empty
+                 buckets in ascending order of rating
+        :rtype: dict
+
+        """
+        logger.info("Processing facets query with rating buckets of %s", bucket)
+        lower = func.floor(cls.rating / bindparam("bucket", bucket)) * bindparam("bucket", bucket)
+        counts = (cls.query if query is None else query).with_entities(
+            lower, func.count(), func.count().filter(cls.available)
+        ).group_by(lower).order_by(lower)
+        rows = db.session.execute(counts.statement).all()
+        total = sum(row[1] for row in rows)
+        available = sum(row[2] for row in rows)
+        return {
+            "total": total,
+            "available": {"true": available, "false": total - available},
+            "rating": [{"min": row[0], "max": row[0] + bucket, "count": row[1]} for row in rows],
+        }
 
     @classmethod
     def create_item_for_supplier(cls, supplier_id: int, item):
         supplier = cls.query.get_or_404(supplier_id)
         supplier.supplier_to_item.append(item)
+        # the ids are read before the commit expires both rows, which would load them again
+        pair = (supplier.id, item.id)
 
         logger.info("Add an item for supplier %s", supplier_id)
         db.session.commit()
+        invalidate_relations([pair])
 
     @classmethod
     def delete_item_for_supplier(cls, supplier_id: int, item):
         supplier = cls.query.get_or_404(supplier_id)
         supplier.supplier_to_item.remove(item)
+        # the ids are read before the commit expires both rows, which would load them again
+        pair = (supplier.id, item.id)
 
         logger.info("Delete an item for supplier %s", supplier_id)
         db.session.commit()
+        invalidate_relations([pair])
 
     @classmethod
-    def list_items_of_supplier(cls, supplier_id: int):
+    def create_items_for_suppliers(cls, pairs: list, chunk_size: int = 1000) -> list:
+        """Relates many Items to Suppliers in one transaction
 
-        supplier = cls.query.get_or_404(supplier_id)
+        Each chunk of pairs is a single INSERT ... SELECT joined to both tables,
+        so pairs with an unknown Supplier or Item are skipped, with ON CONFLICT
+        DO NOTHING for pairs that are already related.
+
+        :param pairs: the (supplier_id, item_id) pairs to relate
+        :type pairs: list
+
+        :return: the pairs that were added
+        :rtype: list
+
+        :raises DataValidationError: when the database rejects the pairs,
+                                     none of which are added then
+
+        """
+        logger.info("Add %d items for suppliers", len(pairs))
+        added = []
+        for start in range(0, len(pairs), chunk_size):
+            chunk = values(column("supplier_id", db.Integer), column("item_id", db.Integer), name="pairs")
+            chunk = chunk.data(pairs[start:start + chunk_size])
+            rows = (
+                select(chunk.c.supplier_id, chunk.c.item_id)
+                .join(cls.__table__, cls.id == chunk.c.supplier_id)
+                .join(Item.__table__, Item.id == chunk.c.item_id)
+            )
+            statement = (
+                postgresql.insert(supplier_item)
+                .from_select(["supplier_id", "item_id"], rows)
+                .on_conflict_do_nothing()
+                .returning(supplier_item.c.supplier_id, supplier_item.c.item_id)
+            )
+            try:
+                added += [tuple(row) for row in db.session.execute(statement)]
+            except DBAPIError as error:
+                db.session.rollback()
+                logger.warning("Relations rejected by the database: %s", str(error.orig).strip())
+                raise DataValidationError("Invalid relations: rejected by the database") from error
+        db.session.commit()
+        invalidate_relations(added)
+        return added
 
+    @classmethod
+    def delete_items_for_suppliers(cls, pairs: list, chunk_size: int = 1000) -> list:
+        """Removes many Supplier-Item relations with DELETE ... WHERE (supplier_id, item_id) IN (...)
+
+        :param pairs: the (supplier_id, item_id) pairs to remove
+        :type pairs: list
+
+        :return: the pairs that were removed
+        :rtype: list
+
+        """
+        logger.info("Delete %d items for suppliers", len(pairs))
+        key = tuple_(supplier_item.c.supplier_id, supplier_item.c.item_id)
+        deleted = []
+        for start in range(0, len(pairs), chunk_size):
+            statement = (
+                supplier_item.delete()
+                .where(key.in_(pairs[start:start + chunk_size]))
+                .returning(supplier_item.c.supplier_id, supplier_item.c.item_id)
+            )
+            deleted += [tuple(row) for row in db.session.execute(statement)]
+        db.session.commit()
+        invalidate_relations(deleted)
+        return deleted
+
+    @classmethod
+    def list_items_of_supplier(cls, supplier_id: int, limit: int = None, cursor: str = None):
+        """Returns the Items of a Supplier a page at a time, ordered by id
+
+        :param supplier_id: the id of the Supplier whose Items you want
+        :type supplier_id: int
+        :param limit: the maximum number of Items to return, None for all
+        :param cursor: the cursor returned with the previous page
+
+        :return: the id and name of each Item of the page and the cursor of the
+                 next page, or 404_NOT_FOUND if the Supplier is not found
+        :rtype: tuple
+
+        """
         logger.info("Processing all items of a supplier")
-        return supplier.supplier_to_item.all()
+        return list_related(cls, supplier_id, limit, cursor)
+
+    @classmethod
+    def search(cls, words: list, limit: int = 20) -> list:
+        """Returns the best matches of some lowercase words as SupplierRecords
+
+        :param words: the words, each the start of a word of the name or address
+        :type words: list
+        :param limit: the number of Suppliers to return at most
+        :type limit: int
+
+        :return: the matching Suppliers, best ranked first
+        :rtype: list
+
+        """
+        logger.info("Processing search query for suppliers %s ...", words)
+        return search_records(cls, SupplierRecord, words, limit)
 
     @classmethod
-    def find_by_availability(cls, available: bool = True) -> list:
+    def find_by_availability(cls, available: bool = True, query=None) -> list:
         """Returns all Suppliers by their availability
 
         :param available: True for suppliers that are available
         :type available: str
+        :param query: the Supplier query to narrow down, all Suppliers if None
 
         :return: a collection of Suppliers that are available
         :rtype: list
 
         """
         logger.info("Processing available query for %s ...", available)
-        return cls.query.filter(cls.available == available)
+        return (cls.query if query is None else query).filter(cls.available == available)
 
     # @classmethod
     # def find_by_gender(cls, gender: Gender = Gender.UNKNOWN) -> list:
@@ -325,13 +1154,22 @@ class Supplier(db.Model):
 class Item(db.Model):
 
     __tablename__ = 'item'
+    # columns whose words search() matches
+    SEARCH_KEYS = ("name",)
+
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
+    version = db.Column(db.BigInteger, nullable=False, server_default=row_version.next_value())
     item_to_supplier = db.relationship('Supplier',
                                        secondary=supplier_item,
                                        lazy='dynamic',
                                        viewonly=True)
 
+    # full text index of search()
+    __table_args__ = (
+        db.Index('ix_item_search', search_vector(name), postgresql_using='gin'),
+    )
+
     ##################################################
     # INSTANCE METHODS
     ##################################################
@@ -344,6 +1182,7 @@ class Item(db.Model):
         return {
             "id": self.id,
             "name": self.name,
+            "version": self.version,
         }
 
     def deserialize(self, data: dict):
@@ -378,12 +1217,7 @@ class Item(db.Model):
         :type data: Flask
 
         """
-        logger.info("Initializing database")
-        # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
-        app.app_context().push()
-        db.drop_all()
-        db.create_all()  # make our sqlalchemy tables
+        init_db(app)
 
     def create(self):
         """
@@ -394,12 +1228,15 @@ class Item(db.Model):
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
         db.session.commit()
+        items_changed(self.id)
 
     def delete(self):
         """Removes an item from the data store"""
         logger.info("Deleting %s", self.name)
+        item_id = cache_key(self.id)
         db.session.delete(self)
         db.session.commit()
+        items_changed(item_id)
 
     @classmethod
     def all(cls) -> list:
@@ -407,9 +1244,22 @@ class Item(db.Model):
         return cls.query.all()
 
     @classmethod
-    def find_by_id(cls, item_id: int) -> list:
-        logger.info("Processing id query for item %s ...", id)
-        return cls.query.get(item_id)
+    def project(cls, query=None):
+        """Narrows an Item query, all Items if None, down to the columns of an ItemRecord"""
+        return project(cls.query if query is None else query, cls, ItemRecord)
+
+    @classmethod
+    def records(cls, query=None) -> list:
+        """Returns the Items of a query, all Items if None, as read-only ItemRecords"""
+        logger.info("Processing Item records")
+        return fetch_records(cls.query if query is None else query, cls, ItemRecord)
+
+    @classmethod
+    def find_by_id(cls, item_id: int, cache: bool = True) -> list:
+        logger.info("Processing id query for item %s ...", item_id)
+        if not cache:
+            return cls.query.get(item_id)
+        return find_cached(cls, item_cache, item_id)
 
     @classmethod
     def find_by_name(cls, name: str) -> list:
@@ -417,7 +1267,262 @@ class Item(db.Model):
         return cls.query.filter(cls.name == name)
 
     @classmethod
-    def list_suppliers_of_item(cls, item_id: int):
-        item = cls.query.filter(cls.id == item_id).first()
+    def search(cls, words: list, limit: int = 20) -> list:
+        """Returns the best matches of some lowercase words as ItemRecords"""
+        logger.info("Processing search query for items %s ...", words)
+        return search_records(cls, ItemRecord, words, limit)
+
+    @classmethod
+    def find_by_supplier(cls, supplier_id: int):
+        """Returns all Items related to the given Supplier"""
+        logger.info("Processing supplier query for items of %s ...", supplier_id)
+        return cls.query.join(supplier_item).filter(supplier_item.c.supplier_id == supplier_id)
+
+    @classmethod
+    def list_suppliers_of_item(cls, item_id: int, limit: int = None, cursor: str = None):
+        """Returns the Suppliers of an Item a page at a time, ordered by id
+
+        :return: the columns of each Supplier of the page and the cursor of the
+                 next page, or 404_NOT_FOUND if the Item is not found
+        :rtype: tuple
+
+        """
         logger.info("Processing all suppliers of an item")
-        return item.item_to_supplier.all()
+        return list_related(cls, item_id, limit, cursor)
+
+
+######################################################################
+#  S U P P L I E R   S T A T I S T I C S
+######################################################################
+# Number of rows the statistics are spread over, so concurrent writes
+# rarely wait on each other for the same row
+STATS_SLOTS = 16
+
+# The count, available count and rating sum of the Suppliers, kept by triggers
+# as the sums of these columns over every slot
+supplier_stats = db.Table('supplier_stats',
+                          db.Column('slot', db.SmallInteger, primary_key=True, autoincrement=False),
+                          db.Column('count', db.BigInteger, nullable=False, default=0),
+                          db.Column('available', db.BigInteger, nullable=False, default=0),
+                          db.Column('rating_sum', db.Numeric, nullable=False, default=0))
+
+# Once per statement, the triggers add the changes of the rows it wrote to a random slot.
+# The rating sum is exact, being kept as a numeric.
+SUPPLIER_STATS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION supplier_stats_apply() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    delta record;
+    target smallint := floor(random() * {STATS_SLOTS});
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE supplier_stats SET count = 0, available = 0, rating_sum = 0;
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        SELECT count(*) AS count, count(*) FILTER (WHERE available) AS available,
+               coalesce(sum(rating::numeric), 0) AS rating_sum
+        INTO delta FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT -count(*) AS count, -count(*) FILTER (WHERE available) AS available,
+               -coalesce(sum(rating::numeric), 0) AS rating_sum
+        INTO delta FROM old_rows;
+    ELSE
+        SELECT 0 AS count,
+               (SELECT count(*) FILTER (WHERE available) FROM new_rows)
+                   - (SELECT count(*) FILTER (WHERE available) FROM old_rows) AS available,
+               (SELECT coalesce(sum(rating::numeric), 0) FROM new_rows)
+                   - (SELECT coalesce(sum(rating::numeric), 0) FROM old_rows) AS rating_sum
+        INTO delta;
+    END IF;
+    IF delta.count <> 0 OR delta.available <> 0 OR delta.rating_sum <> 0 THEN
+        UPDATE supplier_stats
+        SET count = count + delta.count, available = available + delta.available,
+            rating_sum = rating_sum + delta.rating_sum
+        WHERE slot = target;
+    END IF;
+    RETURN NULL;
+END $$
+"""
+SUPPLIER_STATS_TRIGGERS = [
+    "CREATE TRIGGER supplier_stats_insert AFTER INSERT ON supplier"
+    " REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION supplier_stats_apply()",
+    "CREATE TRIGGER supplier_stats_update AFTER UPDATE ON supplier"
+    " REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION supplier_stats_apply()",
+    "CREATE TRIGGER supplier_stats_delete AFTER DELETE ON supplier"
+    " REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION supplier_stats_apply()",
+    "CREATE TRIGGER supplier_stats_truncate AFTER TRUNCATE ON supplier"
+    " FOR EACH STATEMENT EXECUTE FUNCTION supplier_stats_apply()",
+]
+
+
+@event.listens_for(supplier_stats, "after_create")
+def _add_stats_slots(target, connection, **kw):  # pylint: disable=unused-argument
+    """Adds the empty slots of a new statistics table"""
+    connection.execute(supplier_stats.insert(), [{"slot": slot} for slot in range(STATS_SLOTS)])
+
+
+@event.listens_for(Supplier.__table__, "after_create")
+def _add_stats_triggers(target, connection, **kw):  # pylint: disable=unused-argument
+    """Adds the triggers keeping the statistics to a new Supplier table"""
+    connection.execute(text(SUPPLIER_STATS_FUNCTION))
+    for trigger in SUPPLIER_STATS_TRIGGERS:
+        name = trigger.split()[2]
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {name} ON supplier"))
+        connection.execute(text(trigger))
+
+
+def current_supplier_stats(connection) -> tuple:
+    """Returns the count, available count and rating sum of the Suppliers, counted from their rows"""
+    table = Supplier.__table__
+    return connection.execute(db.select(
+        func.count(), func.count().filter(table.c.available), func.coalesce(func.sum(cast(table.c.rating, Numeric)), 0)
+    )).one()
+
+
+def read_supplier_stats() -> dict:
+    """Returns the number of Suppliers, of available ones and their average rating
+
+    These are read from the statistics kept by the triggers, a read of
+    STATS_SLOTS rows whatever the number of Suppliers.
+    """
+    count, available, rating_sum = db.session.execute(db.select(
+        func.coalesce(func.sum(supplier_stats.c.count), 0),
+        func.coalesce(func.sum(supplier_stats.c.available), 0),
+        func.coalesce(func.sum(supplier_stats.c.rating_sum), 0),
+    )).one()
+    count, available = int(count), int(available)
+    return {
+        "count": count,
+        "available": available,
+        "unavailable": count - available,
+        "average_rating": float(rating_sum) / count if count else None,
+    }
+
+
+def reconcile_supplier_stats(connection) -> dict:
+    """Counts the Suppliers again and repairs the statistics kept by the triggers
+
+    The Suppliers are locked against writes while they are counted, then
+    the counts are stored in the first slot and the others are emptied.
+
+    :return: how far the kept statistics were off, for each of them
+    :rtype: dict
+
+    """
+    connection.execute(text("LOCK TABLE supplier IN SHARE MODE"))
+    kept = connection.execute(db.select(
+        func.sum(supplier_stats.c.count), func.sum(supplier_stats.c.available), func.sum(supplier_stats.c.rating_sum)
+    )).one()
+    count, available, rating_sum = current_supplier_stats(connection)
+    connection.execute(supplier_stats.delete())
+    connection.execute(supplier_stats.insert(), [
+        {"slot": slot, "count": 0, "available": 0, "rating_sum": 0} for slot in range(1, STATS_SLOTS)
+    ] + [{"slot": 0, "count": count, "available": available, "rating_sum": rating_sum}])
+    drift = {
+        "count": int((kept[0] or 0) - count),
+        "available": int((kept[1] or 0) - available),
+        "rating_sum": float((kept[2] or 0) - rating_sum),
+    }
+    if any(drift.values()):
+        logger.warning("Repaired the supplier statistics, which were off by %s", drift)
+    return drift
+
+
+######################################################################
+#  S C H E M A   M I G R A T I O N S
+######################################################################
+def _add_supplier_stats(connection):
+    """Adds the statistics of the Suppliers, with the triggers that keep them"""
+    supplier_stats.create(connection, checkfirst=True)
+    _add_stats_triggers(Supplier.__table__, connection)
+    reconcile_supplier_stats(connection)
+
+
+def _create_indexes(connection, indexes):
+    """Creates the indexes not found in the database"""
+    existing = existing_indexes(connection)
+    for index in indexes:
+        if index.name not in existing:
+            index.create(connection)
+
+
+def _add_finder_indexes(connection):
+    """Adds the indexes used by the finders to tables created without them"""
+    _create_indexes(connection, [index for table in (Supplier.__table__, Item.__table__, supplier_item)
+                                 for index in table.indexes])
+
+
+def _add_row_versions(connection):
+    """Adds the version columns, numbering the existing rows from the row version sequence"""
+    row_version.create(connection, checkfirst=True)
+    for table in (Supplier.__table__, Item.__table__):
+        connection.execute(text(
+            f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('{row_version.name}')"
+        ))
+
+
+def _add_search_indexes(connection):
+    """Adds the full text indexes of the search"""
+    _create_indexes(connection, [index for table in (Supplier.__table__, Item.__table__)
+                                 for index in table.indexes if index.name.endswith("_search")])
+
+
+# Each migration upgrades the schema by one version, append new ones at the end.
+# A new database is created from the models and stamped with the latest version.
+MIGRATIONS = [
+    _add_finder_indexes,
+    _add_row_versions,
+    _add_search_indexes,
+    _add_supplier_stats,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def current_schema_version(connection) -> int:
+    """Returns the version of the database schema
+
+    :return: the version, 0 for tables created before versioning,
+             or None for an empty database
+    :rtype: int
+
+    """
+    inspector = inspect(connection)
+    if inspector.has_table(schema_version.name):
+        return connection.execute(db.select(func.max(schema_version.c.version))).scalar() or 0
+    return 0 if inspector.has_table(Supplier.__tablename__) else None
+
+
+def migrate() -> bool:
+    """Upgrades the database schema to SCHEMA_VERSION
+
+    An up to date schema costs a single query. Otherwise the upgrade runs in
+    one transaction, serialized between workers by an advisory lock on
+    PostgreSQL, and never drops any data.
+
+    :return: True if the schema was created or upgraded
+    :rtype: bool
+
+    """
+    try:
+        version = db.session.execute(db.select(func.max(schema_version.c.version))).scalar()
+    except DBAPIError:
+        version = None
+    finally:
+        db.session.remove()
+    if version == SCHEMA_VERSION:
+        logger.info("Database schema is at version %d", SCHEMA_VERSION)
+        return False
+    with db.engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_version'))"))
+        version = current_schema_version(connection)
+        if version is None:
+            logger.info("Creating database schema at version %d", SCHEMA_VERSION)
+            db.metadata.create_all(connection)
+            connection.execute(schema_version.insert(), [{"version": SCHEMA_VERSION}])
+            return True
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            logger.info("Migrating database schema to version %d", number)
+            db.metadata.create_all(connection, tables=[schema_version])
+            MIGRATIONS[number - 1](connection)
+            connection.execute(schema_version.insert(), [{"version": number}])
+    # another worker may have upgraded the schema while this one waited for the lock
+    return version < SCHEMA_VERSION
@@ -0,0 +1,162 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: replicas
+
+Routes the reads of GET requests to the read replicas of the database in
+turn, leaving a replica out for a while when it cannot be reached. Writes,
+and the reads of clients that wrote recently, go to the primary.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, exc, orm
+from service.pool import pool_stats
+
+logger = logging.getLogger("flask.app")
+
+# Cookie set after a write so the client reads its own writes from the primary
+PRIMARY_COOKIE = "read-primary"
+
+
+class ReplicaSet:
+    """
+    Class that represents the read replicas of the database
+
+    Replicas are handed out round-robin. A replica that fails to connect,
+    or whose connection is lost, is ejected for retry seconds.
+    """
+
+    def __init__(self, retry: float = 30.0, clock=time.monotonic):
+        self.engines = []
+        self.retry = retry
+        self.clock = clock
+        self._ejected = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def configure(self, engines: list, retry: float):
+        """Replaces the replicas, disposing of the engines of the previous ones"""
+        for engine in engines:
+            event.listen(engine, "handle_error", self._handle_error)
+        with self._lock:
+            previous, self.engines = self.engines, list(engines)
+            self.retry = retry
+            self._ejected = {}
+            self._next = 0
+        for engine in previous:
+            engine.dispose()
+
+    def choose(self):
+        """Returns the next healthy replica, or None to read from the primary"""
+        with self._lock:
+            now = self.clock()
+            for _ in range(len(self.engines)):
+                engine = self.engines[self._next % len(self.engines)]
+                self._next += 1
+                if self._ejected.get(engine, 0.0) <= now:
+                    return engine
+        return None
+
+    def eject(self, engine):
+        """Leaves a replica out of the rotation for retry seconds"""
+        logger.warning("Ejecting read replica %r for %s seconds", engine.url, self.retry)
+        with self._lock:
+            self._ejected[engine] = self.clock() + self.retry
+
+    def _handle_error(self, context):
+        """Ejects a replica when connecting to it fails or its connection is lost"""
+        if context.is_disconnect or context.connection is None:
+            self.eject(context.engine)
+
+    def stats(self) -> list:
+        """Returns the health and the pool usage of each replica"""
+        now = self.clock()
+        return [
+            {
+                "url": repr(engine.url),
+                "healthy": self._ejected.get(engine, 0.0) <= now,
+                "pool": pool_stats(engine.pool),
+            }
+            for engine in self.engines
+        ]
+
+
+replicas = ReplicaSet()
+
+
+def use_replica(engine):
+    """Sets the replica the reads of the current request go to, None for the primary"""
+    g.replica = engine
+
+
+def current_replica():
+    """Returns the replica the reads of the current request go to, or None"""
+    return g.get("replica") if has_request_context() else None
+
+
+@contextmanager
+def primary():
+    """Sends the reads made inside the block to the primary"""
+    if not has_request_context():
+        yield
+        return
+    previous = g.get("replica")
+    g.replica = None
+    try:
+        yield
+    finally:
+        g.replica = previous
+
+
+class RoutingSession(SignallingSession):
+    """
+    Class that represents a session reading from the replica of its request
+
+    Flushes and DML statements always go to the primary. When connecting to
+    the replica fails the read moves on to the next healthy replica, or to
+    the primary once none is left.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and not getattr(clause, "is_dml", False):
+            engine = self._replica()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+    def _replica(self):
+        """Returns the replica of the request once the session is connected to it"""
+        for _ in range(len(replicas.engines) + 1):
+            engine = current_replica()
+            if engine is None:
+                return None
+            try:
+                # connects once, then returns the connection of the transaction
+                self.connection(bind=engine)
+                return engine
+            except exc.OperationalError:
+                # the failed replica has been ejected by its handle_error listener
+                use_replica(replicas.choose())
+        return None
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Class that represents Flask-SQLAlchemy with sessions routed to the replicas"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -17,18 +17,31 @@ Suppliers Service
 
 Paths:
 ------
-GET /suppliers - Returns a list all of the Suppliers
+GET /suppliers - Returns a list all of the Suppliers, a page at a time with limit and cursor
 GET /suppliers/{id} - Returns the Supplier with a given id number
 POST /suppliers - creates a new Supplier record in the database
 PUT /suppliers/{id} - updates a Supplier record in the database
 DELETE /suppliers/{id} - deletes a Supplier record in the database
 """
 
+import json
+import hashlib
+import math
 import secrets
-from flask_restx import Resource, fields, reqparse, inputs
-from flask import jsonify, request, abort
+from functools import wraps
+from flask_restx import Resource, fields, reqparse, inputs, marshal
+from flask_restx.utils import unpack
+from flask import jsonify, request, abort, Response, stream_with_context
 from flask.logging import create_logger
-from service.model import Supplier, DataValidationError, Item
+from werkzeug.http import quote_etag
+from service.model import Supplier, DataValidationError, VersionConflictError, Item, stream, query_version
+from service.model import SupplierRecord, ItemRecord, db, supplier_cache, item_cache, decode_cursor
+from service.model import read_supplier_stats
+from service.pool import pool_stats
+from service.replicas import PRIMARY_COOKIE, replicas, use_replica
+from service.compression import etag_variants
+from service.search import search, autocomplete, supplier_names, item_names
+from service.serializer import Serializer
 from . import status  # HTTP Status Codes
 from . import app, api  # Import Flask application
 
@@ -55,6 +68,42 @@ def health():
     return jsonify(dict(status="OK")), status.HTTP_200_OK
 
 
+@app.route("/cache")
+def cache_stats():
+    """Hits, misses and evictions of the Supplier and Item caches of this worker"""
+    return jsonify(suppliers=supplier_cache.stats(), items=item_cache.stats()), status.HTTP_200_OK
+
+
+@app.route("/pool")
+def database_pool_stats():
+    """Usage of the database connection pools of this worker"""
+    return jsonify(dict(pool_stats(db.engine.pool), replicas=replicas.stats())), status.HTTP_200_OK
+
+
+######################################################################
+# Read Replicas
+######################################################################
+@app.before_request
+def route_reads():
+    """Sends the reads of a GET request to one replica, unless the client wrote recently"""
+    reading = request.method in ("GET", "HEAD") and PRIMARY_COOKIE not in request.cookies
+    use_replica(replicas.choose() if reading else None)
+
+
+@app.after_request
+def read_your_writes(response):
+    """Sends the reads of a client that wrote to the primary until the replicas catch up"""
+    if replicas.engines and request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        response.set_cookie(PRIMARY_COOKIE, "1", max_age=app.config["REPLICA_READ_YOUR_WRITES"], httponly=True)
+    return response
+
+
+@app.teardown_request
+def remove_session(exception=None):  # pylint: disable=unused-argument
+    """Ends the session of the request, returning its connections to their pools"""
+    db.session.remove()
+
+
 # Define the model so that the docs reflect what can be sent
 create_model_supplier = api.model('Supplier', {
     'name': fields.String(required=True,
@@ -86,17 +135,130 @@ item_model = api.inherit(
     }
 )
 
+# Serializers compiled once from the response models for the list endpoints
+supplier_serializer = Serializer(supplier_model, SupplierRecord)
+item_serializer = Serializer(item_model, ItemRecord)
+
+batch_result_model = api.model('Batch Result', {
+    'index': fields.Integer(readOnly=True, description='The position of the row in the request'),
+    'status': fields.Integer(readOnly=True, description='The HTTP status of the row'),
+    'id': fields.Integer(readOnly=True, description='The id of the row, when it succeeded'),
+    'error': fields.String(readOnly=True, description='Why the row failed, when it did'),
+})
+
+batch_model = api.model('Batch', {
+    'succeeded': fields.Integer(readOnly=True, description='The number of rows that succeeded'),
+    'failed': fields.Integer(readOnly=True, description='The number of rows that failed'),
+    'results': fields.List(fields.Nested(batch_result_model, skip_none=True), description='The result of each row'),
+})
+
+batch_update_model = api.inherit(
+    'Batch Update',
+    api.model('Supplier Patch', {
+        'name': fields.String(description='The new name of the Supplier.'),
+        'available': fields.Boolean(description='The new availability of the Supplier.'),
+        'address': fields.String(description='The new address of the Supplier.'),
+        'rating': fields.Float(description='The new rating of the Supplier.'),
+    }),
+    {
+        'id': fields.Integer(required=True, description='The id of the Supplier to update'),
+    }
+)
+
+batch_affected_model = api.model('Batch Affected', {
+    'affected': fields.List(fields.Integer, description='The ids of the rows that were changed'),
+    'not_found': fields.List(fields.Integer, description='The ids of the rows that were not found'),
+})
+
 supplier_item_relation_model = api.model('Supplier-Item Relation', {
     'supplier_id': fields.Integer(readOnly=True, description='The unique supplier id'),
     'item_id': fields.Integer(readOnly=True, description='The unique item id')
 })
 
-supplier_args = reqparse.RequestParser()
+batch_relation_model = api.model('Batch Relation', {
+    'affected': fields.List(fields.Nested(supplier_item_relation_model),
+                            description='The relations that were changed'),
+    'skipped': fields.List(fields.Nested(supplier_item_relation_model),
+                           description='The relations left as they were or with an unknown Supplier or Item'),
+})
+
+stream_args = reqparse.RequestParser()
+stream_args.add_argument('stream', type=inputs.boolean, required=False,
+                         help='Stream the list instead of building it in memory')
+
+page_args = stream_args.copy()
+page_args.add_argument('limit', type=inputs.positive, required=False, help='Maximum number of Suppliers to return')
+page_args.add_argument('cursor', type=str, required=False, help='Cursor returned in X-Next-Cursor by the previous page')
+
+supplier_args = page_args.copy()
 supplier_args.add_argument('name', type=str, required=False, help='List Suppliers by name')
 supplier_args.add_argument('available', type=inputs.boolean, required=False, help='List Suppliers by availability')
 supplier_args.add_argument('address', type=str, required=False, help='List Suppliers by address')
-supplier_args.add_argument('rating', type=float, required=False, help='List Suppliers by rating')
+supplier_args.add_argument('rating', type=float, required=False, help='List Suppliers by minimum rating')
+supplier_args.add_argument('max-rating', type=float, required=False, help='List Suppliers by maximum rating')
 supplier_args.add_argument('item-id', type=int, required=False, help='List Suppliers by related Item')
+supplier_args.add_argument('sort', type=str, required=False, default='id',
+                           choices=[f"{order}{key}" for key in Supplier.SORT_KEYS for order in ('', '-')],
+                           help='Sort Suppliers by id, name or rating, prefix with - for descending')
+
+# Query arguments that filter the Suppliers and the find_by_filters() parameter each maps to
+SUPPLIER_FILTERS = {
+    'item-id': 'item_id',
+    'name': 'name',
+    'address': 'address',
+    'available': 'available',
+    'rating': 'rating',
+    'max-rating': 'max_rating',
+}
+
+rating_args = page_args.copy()
+rating_args.add_argument('min-rating', type=float, required=False, help='List Suppliers by minimum rating')
+
+search_args = reqparse.RequestParser()
+search_args.add_argument('q', type=str, required=True, help='Words starting words of the names or addresses')
+search_args.add_argument('limit', type=inputs.int_range(1, 100), required=False, default=20,
+                         help='Maximum number of Suppliers and of Items to return')
+
+facet_args = supplier_args.copy()
+for name in ('stream', 'limit', 'cursor', 'sort'):
+    facet_args.remove_argument(name)
+facet_args.add_argument('bucket', type=float, required=False, default=1.0,
+                        help='Width of the rating buckets, each starts at a multiple of it')
+
+rating_bucket_model = api.model('Rating Bucket', {
+    'min': fields.Float(readOnly=True, description='The lowest rating of the bucket'),
+    'max': fields.Float(readOnly=True, description='The rating the bucket ends before'),
+    'count': fields.Integer(readOnly=True, description='The number of Suppliers in the bucket'),
+})
+
+facets_model = api.model('Supplier Facets', {
+    'total': fields.Integer(readOnly=True, description='The number of Suppliers'),
+    'available': fields.Raw(readOnly=True, description='The number of Suppliers by availability, "true" and "false"'),
+    'rating': fields.List(fields.Nested(rating_bucket_model),
+                          description='The number of Suppliers of each non-empty rating bucket, lowest first'),
+})
+
+supplier_stats_model = api.model('Supplier Statistics', {
+    'count': fields.Integer(readOnly=True, description='The number of Suppliers'),
+    'available': fields.Integer(readOnly=True, description='The number of available Suppliers'),
+    'unavailable': fields.Integer(readOnly=True, description='The number of unavailable Suppliers'),
+    'average_rating': fields.Float(readOnly=True, description='The average rating of the Suppliers, null without any'),
+})
+
+autocomplete_args = reqparse.RequestParser()
+autocomplete_args.add_argument('prefix', type=str, required=True, help='Start of the names, in any case')
+autocomplete_args.add_argument('limit', type=inputs.int_range(1, 100), required=False, default=10,
+                               help='Maximum number of names to return')
+
+name_model = api.model('Name', {
+    'id': fields.Integer(readOnly=True, description='The id of the Supplier or Item'),
+    'name': fields.String(readOnly=True, description='The name of the Supplier or Item'),
+})
+
+search_model = api.model('Search Results', {
+    'suppliers': fields.List(fields.Nested(supplier_model), description='The matching Suppliers, best first'),
+    'items': fields.List(fields.Nested(item_model), description='The matching Items, best first'),
+})
 
 
 ######################################################################
@@ -107,6 +269,168 @@ def generate_apikey():
     return secrets.token_hex(16)
 
 
+######################################################################
+# Streaming of large collections
+######################################################################
+NDJSON = "application/x-ndjson"
+
+
+def wants_ndjson():
+    """Returns True if the client accepts NDJSON rather than JSON"""
+    return request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+
+
+def wants_stream():
+    """Returns True if the client asked for a streamed list"""
+    if wants_ndjson():
+        return True
+    return bool(inputs.boolean(request.args.get("stream", False)))
+
+
+def masked_etag(etag: str) -> str:
+    """Returns the ETag of a body, told apart from the bodies of other field masks"""
+    mask = request.headers.get(app.config["RESTX_MASK_HEADER"])
+    if mask:
+        etag += "-fields-" + hashlib.sha1(mask.encode()).hexdigest()[:12]
+    return etag
+
+
+def not_modified(etag: str):
+    """Returns a 304_NOT_MODIFIED response if the client already has this ETag, else None"""
+    for variant in etag_variants(etag):
+        if request.if_none_match.contains(variant):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            response.set_etag(variant)
+            return response
+    return None
+
+
+def check_if_match(supplier):
+    """Aborts with 412_PRECONDITION_FAILED unless If-Match, when sent, has the Supplier's ETag"""
+    etags = etag_variants(str(supplier.version)) + etag_variants(masked_etag(str(supplier.version)))
+    if request.if_match and not any(request.if_match.contains(etag) for etag in etags):
+        abort(status.HTTP_412_PRECONDITION_FAILED,
+              f"Supplier with id '{supplier.id}' does not match If-Match, it was changed since.")
+
+
+def save_supplier(write):
+    """Runs a write of a Supplier, aborting with 412_PRECONDITION_FAILED if it was changed since it was read"""
+    try:
+        write()
+    except VersionConflictError as error:
+        abort(status.HTTP_412_PRECONDITION_FAILED, str(error))
+
+
+def list_etag(query, model, limit: int = None) -> str:
+    """Returns the ETag of a list from the versions of its rows and how it is sent"""
+    etag = masked_etag(query_version(query, model, limit))
+    if wants_stream():
+        etag += "-ndjson" if wants_ndjson() else "-stream"
+    return etag
+
+
+def stream_response(query, serializer):
+    """Streams the rows of a query as NDJSON or as a chunked JSON array
+
+    Rows are read through a server side cursor and written out one at a
+    time, so memory use stays flat no matter how many rows there are.
+    """
+    ndjson = wants_ndjson()
+
+    def generate():
+        count = 0
+        if not ndjson:
+            yield "["
+        for row in stream(query):
+            data = serializer.dumps_row(row)
+            if ndjson:
+                yield data + "\n"
+            else:
+                yield ("," if count else "") + data
+            count += 1
+        if not ndjson:
+            yield "]"
+        LOG.info("Streamed %d rows", count)
+
+    mimetype = NDJSON if ndjson else "application/json"
+    return Response(stream_with_context(generate()), status.HTTP_200_OK, mimetype=mimetype)
+
+
+def filtered_suppliers(args):
+    """Returns the query of the Suppliers matching the SUPPLIER_FILTERS args"""
+    filters = {
+        name: args[arg] for arg, name in SUPPLIER_FILTERS.items() if args[arg] not in (None, '')
+    }
+    log = "".join(f" by {name}={value}" for name, value in filters.items())
+    LOG.info("Listing suppliers" + log)
+    return Supplier.find_by_filters(**filters)
+
+
+def rated_suppliers(args):
+    """Returns the query of the Suppliers rated at least the min-rating arg"""
+    if args['min-rating'] is not None:
+        return Supplier.find_by_rating(args['min-rating'])
+    return Supplier.query
+
+
+def supplier_page(query, sort, args):
+    """Returns the page of a Supplier query selected by the limit and cursor args
+
+    The Suppliers are streamed when the client asked for it, otherwise the
+    cursor of the next page is returned in the X-Next-Cursor header. Nothing
+    is loaded when the client already has the current version of the page,
+    whose ETag covers one row past it so a new next page changes it too.
+    """
+    page = Supplier.keyset(query, sort=sort, cursor=args['cursor'])
+    etag = list_etag(page, Supplier, args['limit'] + 1 if args['limit'] else None)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    if wants_stream():
+        if args['limit']:
+            page = page.limit(args['limit'])
+        response = stream_response(Supplier.project(page), supplier_serializer)
+        response.set_etag(etag)
+        return response
+
+    suppliers, next_cursor = Supplier.paginate(Supplier.project(query), sort=sort, limit=args['limit'], cursor=args['cursor'])
+    headers = {"ETag": quote_etag(etag)}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    LOG.info("Returning %d suppliers", len(suppliers))
+    return list_response(supplier_serializer, suppliers, headers)
+
+
+def list_response(serializer, rows, headers):
+    """Returns the rows of a serializer's record type as the JSON list of its model
+
+    Requests with a field mask are marshalled by flask-restx instead.
+    """
+    if request.headers.get(app.config["RESTX_MASK_HEADER"]):
+        return [row._asdict() for row in rows], status.HTTP_200_OK, headers
+    return Response(serializer.dumps(rows), status.HTTP_200_OK, headers, mimetype="application/json")
+
+
+def marshal_or_response(model, as_list: bool = False):
+    """Marshals like api.marshal_with but passes responses, such as streams and 304s, through"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            resp = func(*args, **kwargs)
+            if isinstance(resp, Response):
+                return resp
+            data, code, headers = unpack(resp)
+            mask = request.headers.get(app.config["RESTX_MASK_HEADER"])
+            return marshal(data, model, mask=mask), code, headers
+        return api.response(status.HTTP_200_OK, 'Success', [model] if as_list else model)(wrapper)
+    return decorator
+
+
+def marshal_list_or_stream(model):
+    """Marshals a list like api.marshal_list_with but passes streamed responses through"""
+    return marshal_or_response(model, as_list=True)
+
+
 ######################################################################
 #  PATH: /suppliers/<supplier_id>
 ######################################################################
@@ -126,7 +450,8 @@ class SupplierResource(Resource):
     # -------------------------------------------------------------------
     @api.doc('get_suppliers')
     @api.response(404, 'Supplier not found')
-    @api.marshal_with(supplier_model)
+    @api.response(304, 'Supplier not modified')
+    @marshal_or_response(supplier_model)
     def get(self, supplier_id):
         """
         Retrieve a single Supplier
@@ -137,7 +462,11 @@ class SupplierResource(Resource):
         supplier = Supplier.find(supplier_id)
         if not supplier:
             abort(status.HTTP_404_NOT_FOUND, f"Supplier with id '{supplier_id}' was not found.")
-        return supplier.serialize(), status.HTTP_200_OK
+        etag = masked_etag(str(supplier.version))
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        return supplier.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
 
     # -------------------------------------------------------------------
     # UPDATE A SUPPLIER
@@ -145,6 +474,7 @@ class SupplierResource(Resource):
     @api.doc('update_suppliers', security='apikey')
     @api.response(404, 'Supplier not found')
     @api.response(400, 'The posted Supplier data was not valid')
+    @api.response(412, 'The Supplier was changed since the If-Match version')
     @api.expect(supplier_model)
     @api.marshal_with(supplier_model)
     # @token_required
@@ -155,22 +485,24 @@ class SupplierResource(Resource):
         This endpoint will update a Supplier based the body that is posted
         """
         LOG.info("Request to update supplier with id: %s", supplier_id)
-        supplier = Supplier.find(supplier_id)
+        supplier = Supplier.find(supplier_id, cache=False)
         if not supplier:
             abort(status.HTTP_404_NOT_FOUND, f"Supplier with id '{supplier_id}' was not found.")
+        check_if_match(supplier)
 
         LOG.info(f"Payload = {api.payload}")
         supplier.deserialize(api.payload)
         supplier.id = supplier_id
-        supplier.update()
+        save_supplier(supplier.update)
         LOG.info("Supplier with ID [%s] updated.", supplier.id)
-        return supplier.serialize(), status.HTTP_200_OK
+        return supplier.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(masked_etag(str(supplier.version)))}
 
     # -------------------------------------------------------------------
     # DELETE A SUPPLIER
     # -------------------------------------------------------------------
     @api.doc('delete_suppliers', security='apikey')
     @api.response(204, 'Supplier deleted')
+    @api.response(412, 'The Supplier was changed since the If-Match version')
     # @token_required
     def delete(self, supplier_id):
         """
@@ -179,9 +511,10 @@ class SupplierResource(Resource):
         This endpoint will delete a Supplier based the id specified in the path
         """
         LOG.info("Request to delete supplier with id: %s", supplier_id)
-        supplier = Supplier.find(supplier_id)
+        supplier = Supplier.find(supplier_id, cache=False)
         if supplier:
-            supplier.delete()
+            check_if_match(supplier)
+            save_supplier(supplier.delete)
         LOG.info("Supplier with ID [%s] delete complete.", supplier_id)
 
         return "", status.HTTP_204_NO_CONTENT
@@ -197,37 +530,13 @@ class SupplierCollection(Resource):
     # -------------------------------------------------------------------
     @api.doc('list_suppliers')
     @api.expect(supplier_args, validate=True)
-    @api.marshal_list_with(supplier_model)
+    @marshal_list_or_stream(supplier_model)
     def get(self):
         """Returns all of the Suppliers"""
         LOG.info("Request for supplier list")
-        log = ''
-        suppliers = []
-
         args = supplier_args.parse_args(strict=False)
         LOG.info("Arguments parsed.")
-
-        if args['item-id']:
-            suppliers = Item.list_suppliers_of_item(args['item-id'])
-            log = f" by item_id={args['item-id']}"
-        elif args['name']:
-            suppliers = Supplier.find_by_name(args['name'])
-            log = f" by name={args['name']}"
-        elif args['address']:
-            suppliers = Supplier.find_by_address(args['address'])
-            log = f" by address={args['address']}"
-        elif args['available']:
-            suppliers = Supplier.find_by_availability(args['available'])
-            log = f" by availability={args['available']}"
-        elif args['rating']:
-            suppliers = Supplier.find_by_rating(args['rating'])
-            log = f" by rating>={args['rating']}"
-        else:
-            suppliers = Supplier.all()
-
-        results = [supplier.serialize() for supplier in suppliers]
-        LOG.info(f"Returning {len(results)} suppliers" + log)
-        return results, status.HTTP_200_OK
+        return supplier_page(filtered_suppliers(args), args['sort'], args)
 
     # -------------------------------------------------------------------
     # ADD A NEW SUPPLIER
@@ -252,6 +561,105 @@ class SupplierCollection(Resource):
         LOG.info("Supplier with ID [%s] created.", supplier.id)
         return supplier.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
 
+# #####################################################################
+#  PATH: /suppliers:batch
+# #####################################################################
+@api.route('/suppliers:batch', strict_slashes=False)
+class SupplierBatch(Resource):
+    """ Handles changes to many Suppliers in one request """
+    # -------------------------------------------------------------------
+    # ADD MANY NEW SUPPLIERS
+    # -------------------------------------------------------------------
+    @api.doc('create_suppliers_batch', security='apikey')
+    @api.response(400, 'The posted data was not a list')
+    @api.expect([create_model_supplier])
+    @api.marshal_with(batch_model, skip_none=True)
+    def post(self):
+        """
+        Creates many Suppliers
+        This endpoint will create a Supplier for each row of the posted JSON array or NDJSON
+        """
+        LOG.info("Request to create a batch of suppliers")
+        rows = batch_payload()
+        results = [None] * len(rows)
+        suppliers = []
+        for index, data in enumerate(rows):
+            try:
+                if isinstance(data, Exception):
+                    raise data
+                suppliers.append((index, Supplier().deserialize(data)))
+            except DataValidationError as error:
+                results[index] = batch_result(index, error=error)
+
+        ids = Supplier.create_many([supplier for _, supplier in suppliers], app.config['BATCH_SIZE'])
+        for (index, _), supplier_id in zip(suppliers, ids):
+            if isinstance(supplier_id, Exception):
+                results[index] = batch_result(index, error=supplier_id)
+            else:
+                results[index] = batch_result(index, status.HTTP_201_CREATED, supplier_id)
+        return batch_summary(results), status.HTTP_200_OK
+
+    # -------------------------------------------------------------------
+    # UPDATE MANY SUPPLIERS
+    # -------------------------------------------------------------------
+    @api.doc('update_suppliers_batch', security='apikey')
+    @api.response(400, 'The posted data was not valid')
+    @api.expect([batch_update_model])
+    @api.marshal_with(batch_affected_model)
+    def patch(self):
+        """
+        Updates many Suppliers
+        This endpoint will apply the attributes posted with each id to that Supplier, in one transaction
+        """
+        LOG.info("Request to update a batch of suppliers")
+        check_content_type("application/json")
+        rows = api.payload
+        if not isinstance(rows, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Batch body must be a JSON array")
+        patches = {}
+        for index, data in enumerate(rows):
+            if not isinstance(data, dict) or not valid_id(data.get("id")):
+                abort(status.HTTP_400_BAD_REQUEST, f"Row {index} must be an object with an integer id")
+            data = dict(data)
+            supplier_id = data.pop("id")
+            if supplier_id in patches:
+                abort(status.HTTP_400_BAD_REQUEST, f"Row {index}: id {supplier_id} is already patched by another row")
+            try:
+                patches[supplier_id] = Supplier.validate_patch(data)
+            except DataValidationError as error:
+                abort(status.HTTP_400_BAD_REQUEST, f"Row {index}: {error}")
+        try:
+            updated = Supplier.update_many(patches)
+        except DataValidationError as error:
+            abort(status.HTTP_400_BAD_REQUEST, str(error))
+        LOG.info("Updated %d suppliers", len(updated))
+        return batch_affected(patches, updated), status.HTTP_200_OK
+
+    # -------------------------------------------------------------------
+    # DELETE MANY SUPPLIERS
+    # -------------------------------------------------------------------
+    @api.doc('delete_suppliers_batch', security='apikey')
+    @api.response(400, 'The posted data was not a list of ids')
+    @api.expect([fields.Integer])
+    @api.marshal_with(batch_affected_model)
+    def delete(self):
+        """
+        Deletes many Suppliers
+        This endpoint will delete the Suppliers whose ids are posted as a JSON array
+        """
+        LOG.info("Request to delete a batch of suppliers")
+        check_content_type("application/json")
+        ids = api.payload
+        if not isinstance(ids, list) or not all(valid_id(value) for value in ids):
+            abort(status.HTTP_400_BAD_REQUEST, "Batch body must be a JSON array of integer ids")
+        try:
+            deleted = Supplier.delete_many(ids)
+        except DataValidationError as error:
+            abort(status.HTTP_400_BAD_REQUEST, str(error))
+        LOG.info("Deleted %d suppliers", len(deleted))
+        return batch_affected(ids, deleted), status.HTTP_200_OK
+
+
 # #####################################################################
 # PATH: /suppliers/rating
 # #####################################################################
@@ -262,16 +670,13 @@ class RateSuppliers(Resource):
     # SORT SUPPLIERS BY THEIR RATING
     # -------------------------------------------------------------------
     @api.doc('rating_suppliers')
-    @api.marshal_with(supplier_model)
+    @api.expect(rating_args, validate=True)
+    @marshal_list_or_stream(supplier_model)
     def get(self):
-        """Returns all of the Suppliers sorted by their rating."""
+        """Returns the Suppliers sorted by their rating, highest first."""
         LOG.info("Request for supplier list sort by rating")
-        suppliers = []
-        suppliers = Supplier.all()
-        results = [supplier.serialize() for supplier in suppliers]
-        sorted_res = sorted(results, key=lambda d: d["rating"], reverse=True)
-        LOG.info("Returning %d suppliers", len(results))
-        return sorted_res, status.HTTP_200_OK
+        args = rating_args.parse_args(strict=False)
+        return supplier_page(rated_suppliers(args), '-rating', args)
 
 # #####################################################################
 # PATH: /suppliers/<supplier_id>/active
@@ -283,6 +688,7 @@ class ActivateSuppliers(Resource):
     @api.doc('activate_suppliers')
     @api.response(404, 'Supplier not found')
     @api.response(400, 'Supplier is already active')
+    @api.response(412, 'The Supplier was changed since the If-Match version')
     @api.marshal_with(supplier_model)
     def put(self, supplier_id):
         """
@@ -291,20 +697,21 @@ class ActivateSuppliers(Resource):
         """
         LOG.info("Request to activate supplier with id: %s", supplier_id)
 
-        supplier = Supplier.find(supplier_id)
+        supplier = Supplier.find(supplier_id, cache=False)
 
         if not supplier:
             abort(status.HTTP_404_NOT_FOUND, f"Supplier with id '{supplier_id}' was not found.")
 
+        check_if_match(supplier)
         if supplier.available:
             abort(status.HTTP_400_BAD_REQUEST, f"Supplier with id '{supplier_id}' is already active.")
 
         supplier.available = True
         supplier.id = supplier_id
-        supplier.update()
+        save_supplier(supplier.update)
 
         LOG.info("Supplier with ID [%s] activated", supplier.id)
-        return supplier.serialize(), status.HTTP_200_OK
+        return supplier.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(masked_etag(str(supplier.version)))}
 
 # #####################################################################
 # PATH: /suppliers/<supplier_id>/active
@@ -316,6 +723,7 @@ class DeactiveSupplier(Resource):
     @api.doc('deactivate_suppliers')
     @api.response(404, 'Supplier not found')
     @api.response(400, 'Supplier is already deactive')
+    @api.response(412, 'The Supplier was changed since the If-Match version')
     @api.marshal_with(supplier_model)
     def delete(self, supplier_id):
         """
@@ -325,20 +733,21 @@ class DeactiveSupplier(Resource):
         """
         LOG.info("Request to deactivate supplier with id: %s", supplier_id)
 
-        supplier = Supplier.find(supplier_id)
+        supplier = Supplier.find(supplier_id, cache=False)
 
         if not supplier:
             abort(status.HTTP_404_NOT_FOUND, f"Supplier with id '{supplier_id}' was not found.")
 
+        check_if_match(supplier)
         if not supplier.available:
             abort(status.HTTP_400_BAD_REQUEST, f"Supplier with id '{supplier_id}' is already deactivated.")
 
         supplier.available = False
         supplier.id = supplier_id
-        supplier.update()
+        save_supplier(supplier.update)
 
         LOG.info("Supplier with ID [%s] deactivated", supplier.id)
-        return supplier.serialize(), status.HTTP_200_OK
+        return supplier.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(masked_etag(str(supplier.version)))}
 
 # #####################################################################
 #  PATH: /items
@@ -350,16 +759,24 @@ class ItemCollection(Resource):
     # LIST ALL ITEMS
     # ------------------------------------------------------------------
     @api.doc('list_items')
-    @api.marshal_list_with(item_model)
+    @api.expect(stream_args, validate=True)
+    @marshal_list_or_stream(item_model)
     def get(self):
         """Returns all of the Suppliers"""
         LOG.info("Request for item list")
-        items = []
-        items = Item.all()
-
-        results = [item.serialize() for item in items]
-        LOG.info("Returning %d items", len(results))
-        return results, status.HTTP_200_OK
+        stream_args.parse_args(strict=False)
+        etag = list_etag(Item.query, Item)
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        if wants_stream():
+            response = stream_response(Item.project().order_by(Item.id), item_serializer)
+            response.set_etag(etag)
+            return response
+        items = Item.records()
+
+        LOG.info("Returning %d items", len(items))
+        return list_response(item_serializer, items, {"ETag": quote_etag(etag)})
 
     # ------------------------------------------------------------------
     # ADD A NEW ITEM
@@ -404,7 +821,8 @@ class ItemResource(Resource):
     # ------------------------------------------------------------------
     @api.doc('get_item')
     @api.response(404, 'Item not found')
-    @api.marshal_with(item_model)
+    @api.response(304, 'Item not modified')
+    @marshal_or_response(item_model)
     def get(self, item_id):
         """
         Retrieve a single Item
@@ -414,7 +832,11 @@ class ItemResource(Resource):
         item = Item.find_by_id(item_id)
         if not item:
             abort(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
-        return item.serialize(), status.HTTP_200_OK
+        etag = masked_etag(str(item.version))
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        return item.serialize(), status.HTTP_200_OK, {"ETag": quote_etag(etag)}
 
     # ------------------------------------------------------------------
     # DELETE AN ITEM
@@ -429,7 +851,7 @@ class ItemResource(Resource):
         This endpoint will delete an Item based the id specified in the path
         """
         LOG.info("Request to delete item with id: %s", item_id)
-        item = Item.find_by_id(item_id)
+        item = Item.find_by_id(item_id, cache=False)
         if item:
             item.delete()
 
@@ -464,7 +886,7 @@ class SupplierItemRelation(Resource):
         """
         LOG.info("Request to add an item to a supplier with id: %s", supplier_id)
         # item_id = request.args.get("item-id")
-        item = Item.find_by_id(item_id)
+        item = Item.find_by_id(item_id, cache=False)
         if not item:
             abort(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
         Supplier.create_item_for_supplier(supplier_id=supplier_id, item=item)
@@ -484,13 +906,61 @@ class SupplierItemRelation(Resource):
         Delete an item of a Supplier
         """
         LOG.info("Delete an item of supplier %s", supplier_id)
-        item = Item.find_by_id(item_id)
+        item = Item.find_by_id(item_id, cache=False)
         if item:
             Supplier.delete_item_for_supplier(supplier_id, item)
 
         LOG.info("Item with ID [%s] delete for supplier %s complete.", item_id, supplier_id)
         return "", status.HTTP_204_NO_CONTENT
 
+######################################################################
+#  PATH: /suppliers/items:batch
+######################################################################
+@api.route('/suppliers/items:batch', strict_slashes=False)
+class SupplierItemRelationBatch(Resource):
+    """ Handles many Supplier-Item Relations in one request """
+    # ------------------------------------------------------------------
+    # ADD MANY ITEMS TO SUPPLIERS
+    # ------------------------------------------------------------------
+    @api.doc('add_supplier_item_relations_batch', security='apikey')
+    @api.response(400, 'The posted data was not a list of relations')
+    @api.expect([supplier_item_relation_model])
+    @api.marshal_with(batch_relation_model)
+    def post(self):
+        """
+        Add many items to Suppliers
+
+        The endpoint will add every posted Supplier-Item pair to the relationship table
+        """
+        LOG.info("Request to add a batch of items to suppliers")
+        pairs = relation_pairs()
+        try:
+            added = Supplier.create_items_for_suppliers(pairs, app.config['BATCH_SIZE'])
+        except DataValidationError as error:
+            abort(status.HTTP_400_BAD_REQUEST, str(error))
+        LOG.info("Added %d of %d items to suppliers", len(added), len(pairs))
+        return batch_relations(pairs, added), status.HTTP_200_OK
+
+    # ------------------------------------------------------------------
+    # DELETE MANY ITEMS OF SUPPLIERS
+    # ------------------------------------------------------------------
+    @api.doc('delete_supplier_item_relations_batch', security='apikey')
+    @api.response(400, 'The posted data was not a list of relations')
+    @api.expect([supplier_item_relation_model])
+    @api.marshal_with(batch_relation_model)
+    def delete(self):
+        """
+        Delete many items of Suppliers
+
+        The endpoint will delete every posted Supplier-Item pair from the relationship table
+        """
+        LOG.info("Request to delete a batch of items of suppliers")
+        pairs = relation_pairs()
+        deleted = Supplier.delete_items_for_suppliers(pairs, app.config['BATCH_SIZE'])
+        LOG.info("Deleted %d of %d items of suppliers", len(deleted), len(pairs))
+        return batch_relations(pairs, deleted), status.HTTP_200_OK
+
+
 ######################################################################
 #  PATH: /suppliers/{sid}}/items
 ######################################################################
@@ -503,16 +973,113 @@ class SupplierItemRelationCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc('list_items_of_supplier')
     @api.response(404, 'Supplier not found')
-    @api.marshal_list_with(item_model)
+    @api.expect(page_args, validate=True)
+    @marshal_list_or_stream(item_model)
     def get(self, supplier_id):
-        """ Returns all of the Items of a Supplier """
+        """ Returns the Items of a Supplier, a page at a time with limit and cursor """
         LOG.info("List all items of supplier %s", supplier_id)
-        items = []
-        items = Supplier.list_items_of_supplier(supplier_id)
-
-        results = [item.serialize() for item in items]
+        args = page_args.parse_args(strict=False)
+        if wants_stream():
+            Supplier.find_or_404(supplier_id)
+            items = Item.find_by_supplier(supplier_id)
+            if args['cursor']:
+                try:
+                    items = items.filter(Item.id > decode_cursor("id", args['cursor'])[0])
+                except DataValidationError as error:
+                    abort(status.HTTP_400_BAD_REQUEST, str(error))
+            items = Item.project(items).order_by(Item.id)
+            if args['limit']:
+                items = items.limit(args['limit'])
+            return stream_response(items, item_serializer)
+        items, next_cursor = Supplier.list_items_of_supplier(supplier_id, args['limit'], args['cursor'])
+
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        results = [item._asdict() for item in items]
         LOG.info("Returning %d items", len(results))
-        return results, status.HTTP_200_OK
+        return results, status.HTTP_200_OK, headers
+
+
+######################################################################
+#  PATH: /suppliers/facets
+######################################################################
+@api.route('/suppliers/facets', strict_slashes=False)
+class SupplierFacets(Resource):
+    """ Handles the counts of the Suppliers by availability and rating """
+    @api.doc('supplier_facets')
+    @api.response(400, 'The bucket width is not a positive number')
+    @api.expect(facet_args, validate=True)
+    @api.marshal_with(facets_model)
+    def get(self):
+        """ Returns the number of Suppliers matching the list filters, by availability and by rating bucket """
+        args = facet_args.parse_args(strict=False)
+        if not (args['bucket'] > 0 and math.isfinite(args['bucket'])):
+            abort(status.HTTP_400_BAD_REQUEST, "The bucket width must be a positive number")
+        return Supplier.facets(filtered_suppliers(args), args['bucket']), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /suppliers/stats
+######################################################################
+@api.route('/suppliers/stats', strict_slashes=False)
+class SupplierStats(Resource):
+    """ Handles the statistics of all the Suppliers """
+    @api.doc('supplier_stats')
+    @api.marshal_with(supplier_stats_model)
+    def get(self):
+        """ Returns the number of Suppliers, of available ones and their average rating """
+        return read_supplier_stats(), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /suppliers/autocomplete
+######################################################################
+@api.route('/suppliers/autocomplete', strict_slashes=False)
+class SupplierAutocomplete(Resource):
+    """ Handles the completion of Supplier names """
+    @api.doc('autocomplete_suppliers')
+    @api.expect(autocomplete_args, validate=True)
+    @api.marshal_list_with(name_model)
+    def get(self):
+        """ Returns the Suppliers whose name starts with prefix, in alphabetical order """
+        args = autocomplete_args.parse_args(strict=False)
+        rows = autocomplete(supplier_names, args['prefix'], args['limit'])
+        return [row.serialize() for row in rows], status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /items/autocomplete
+######################################################################
+@api.route('/items/autocomplete', strict_slashes=False)
+class ItemAutocomplete(Resource):
+    """ Handles the completion of Item names """
+    @api.doc('autocomplete_items')
+    @api.expect(autocomplete_args, validate=True)
+    @api.marshal_list_with(name_model)
+    def get(self):
+        """ Returns the Items whose name starts with prefix, in alphabetical order """
+        args = autocomplete_args.parse_args(strict=False)
+        rows = autocomplete(item_names, args['prefix'], args['limit'])
+        return [row.serialize() for row in rows], status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /search
+######################################################################
+@api.route('/search', strict_slashes=False)
+class SearchResource(Resource):
+    """ Handles searches of the Suppliers and Items by the words of their names """
+    # ------------------------------------------------------------------
+    # SEARCH THE SUPPLIERS AND ITEMS
+    # ------------------------------------------------------------------
+    @api.doc('search')
+    @api.expect(search_args, validate=True)
+    @api.marshal_with(search_model)
+    def get(self):
+        """ Returns the Suppliers and Items with words starting with each word of q, best first """
+        args = search_args.parse_args(strict=False)
+        LOG.info("Search for %r", args['q'])
+        results = search(args['q'], args['limit'])
+        return {name: [row.serialize() for row in rows] for name, rows in results.items()}, status.HTTP_200_OK
 
 
 ######################################################################
@@ -523,6 +1090,82 @@ class SupplierItemRelationCollection(Resource):
 #     LOG.info(message)
 #     api.abort(error_code, message)
 
+def batch_payload() -> list:
+    """Returns the rows of a batch request posted as a JSON array or as NDJSON
+
+    NDJSON lines that are not valid JSON come back as DataValidationErrors
+    so they can be reported with the other invalid rows.
+    """
+    if request.mimetype == NDJSON:
+        rows = []
+        for number, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(DataValidationError(f"Invalid JSON on line {number}"))
+        return rows
+    check_content_type("application/json")
+    if not isinstance(api.payload, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Batch body must be a JSON array or NDJSON")
+    return api.payload
+
+
+def batch_result(index: int, code: int = status.HTTP_400_BAD_REQUEST, row_id: int = None, error=None) -> dict:
+    """Returns the result of one row of a batch request"""
+    result = {"index": index, "status": code}
+    if row_id is not None:
+        result["id"] = row_id
+    if error is not None:
+        result["error"] = str(error)
+    return result
+
+
+def batch_summary(results: list) -> dict:
+    """Returns the response body of a batch request from the result of each row"""
+    succeeded = sum(1 for result in results if result["status"] < status.HTTP_400_BAD_REQUEST)
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+
+def batch_affected(ids, affected: list) -> dict:
+    """Returns the response body of a set based batch request"""
+    found = set(affected)
+    return {"affected": affected, "not_found": sorted(set(ids) - found)}
+
+
+def relation_pairs() -> list:
+    """Returns the (supplier_id, item_id) pairs posted as a JSON array of relations"""
+    check_content_type("application/json")
+    rows = api.payload
+    if not isinstance(rows, list):
+        abort(status.HTTP_400_BAD_REQUEST, "Batch body must be a JSON array")
+    pairs = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict) or not all(valid_id(row.get(key), 1) for key in ("supplier_id", "item_id")):
+            abort(status.HTTP_400_BAD_REQUEST, f"Row {index} must have an integer supplier_id and item_id")
+        pairs.append((row["supplier_id"], row["item_id"]))
+    return pairs
+
+
+def batch_relations(pairs: list, affected: list) -> dict:
+    """Returns the response body of a batch request on Supplier-Item relations"""
+    done = set(affected)
+    return {
+        "affected": [{"supplier_id": pair[0], "item_id": pair[1]} for pair in affected],
+        "skipped": [{"supplier_id": pair[0], "item_id": pair[1]} for pair in dict.fromkeys(pairs) if pair not in done],
+    }
+
+
+# The largest id an integer id column holds
+MAX_ID = 2 ** 31 - 1
+
+
+def valid_id(value, smallest: int = 0) -> bool:
+    """Returns True for a JSON integer from smallest that fits the id columns, JSON booleans being rejected"""
+    return type(value) is int and smallest <= value <= MAX_ID  # pylint: disable=unidiomatic-typecheck
+
+
 def check_content_type(media_type):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
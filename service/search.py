@@ -0,0 +1,360 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: search
+
+Searches the words of the Supplier names and addresses and of the Item
+names. The search runs on the full text indexes of the tables, or with
+SEARCH_BACKEND=memory through a per worker inverted index of the words,
+built on first use and kept up to date from the writes made through the
+model.
+
+Names are completed from a per worker sorted list of the names, kept up
+to date the same way, without a query per keystroke.
+"""
+import re
+import abc
+import time
+import heapq
+import logging
+import threading
+from bisect import bisect_left, insort
+from collections import namedtuple
+from flask import current_app
+from service.model import Supplier, Item, SupplierRecord, ItemRecord, supplier_copies, item_copies, stream
+from service.replicas import primary
+
+logger = logging.getLogger("flask.app")
+
+# A word is a run of letters and digits, like the words of the full text search
+WORD = re.compile(r"[^\W_]+")
+
+
+def search_words(text: str) -> list:
+    """Returns the distinct lowercase words of a text, in order"""
+    return list(dict.fromkeys(WORD.findall(text.lower())))
+
+
+class RowIndex(abc.ABC):
+    """
+    Class that represents a per worker index of the rows of a model
+
+    The index is built from every row on first use. Rows written through
+    the model are read again on the next lookup, and the whole index is
+    rebuilt every ttl seconds to pick up other writes. A rebuild streams
+    the rows into new lookup structures outside the lock, then swaps them
+    in, so lookups keep using the old index meanwhile. Subclasses make the
+    entry of each row, build the lookup structures from the entries and
+    keep them up to date.
+    """
+
+    def __init__(self, model, columns: tuple, clock=time.monotonic):
+        self.model = model
+        self.columns = columns
+        self.clock = clock
+        self._rows = {}
+        self._dirty = set()
+        # ids written during a rebuild, which may have streamed them before the write
+        self._written = None
+        self._tracking = False
+        self._built_at = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def invalidate(self, *ids):
+        """Marks rows as written, they are read again on the next lookup"""
+        with self._lock:
+            if self._tracking:
+                self._dirty.update(ids)
+            if self._written is not None:
+                self._written.update(ids)
+
+    def clear(self):
+        """Drops the index, it is built again on the next lookup"""
+        with self._lock:
+            self._built_at = None
+
+    def _stale(self, ttl: float) -> bool:
+        """Returns True when the index is missing or older than ttl"""
+        with self._lock:
+            return self._built_at is None or self._built_at + ttl <= self.clock()
+
+    def refresh(self, ttl: float):
+        """Builds the index when missing or older than ttl, else reads the written rows again
+
+        Only one thread rebuilds at a time. The others wait for the first
+        build, and use the old index during the later ones.
+        """
+        if self._stale(ttl) and self._build_lock.acquire(blocking=self._built_at is None):
+            try:
+                if self._stale(ttl):
+                    self._rebuild()
+            finally:
+                self._build_lock.release()
+        self._read_written()
+
+    def _query(self):
+        """Returns the query of the indexed columns of the rows"""
+        return self.model.query.with_entities(*(getattr(self.model, name) for name in self.columns))
+
+    def _rebuild(self):
+        """Streams every row into new lookup structures and swaps them in"""
+        with self._lock:
+            started = self.clock()
+            self._tracking = True
+            self._written = set()
+        try:
+            with primary():
+                rows, state = self._build(self._entry(row) for row in stream(self._query()))
+        except Exception:
+            with self._lock:
+                self._written = None
+            raise
+        with self._lock:
+            self._rows = rows
+            self._install(state)
+            self._dirty |= self._written
+            self._written = None
+            self._built_at = started
+        logger.info("Built the %s of %d %ss", type(self).__name__, len(rows), self.model.__name__)
+
+    def _read_written(self):
+        """Reads the rows written since the last lookup again"""
+        with self._lock:
+            if not self._dirty:
+                return
+            ids, self._dirty = self._dirty, set()
+            for row_id in ids:
+                entry = self._rows.pop(row_id, None)
+                if entry is not None:
+                    self._remove(entry)
+            with primary():
+                rows = self._query().filter(self.model.id.in_(ids)).all()
+            for row in rows:
+                entry = self._entry(row)
+                self._rows[entry.id] = entry
+                self._add(entry)
+
+    @abc.abstractmethod
+    def _entry(self, row):
+        """Returns the entry indexing a row of the columns"""
+
+    @abc.abstractmethod
+    def _build(self, entries) -> tuple:
+        """Returns the entries by id and the lookup structures of every entry, without changing the index"""
+
+    @abc.abstractmethod
+    def _install(self, state):
+        """Replaces the lookup structures with those built by _build()"""
+
+    @abc.abstractmethod
+    def _add(self, entry):
+        """Indexes the entry of a row read again"""
+
+    @abc.abstractmethod
+    def _remove(self, entry):
+        """Removes the entry of a row written since it was indexed"""
+
+
+class WordIndex(RowIndex):
+    """
+    Class that represents an inverted index of the words of a model
+
+    Each word maps to the ids of the rows holding it, and the sorted list
+    of the words finds those starting with a prefix by bisection.
+    """
+
+    def __init__(self, model, record, clock=time.monotonic):
+        super().__init__(model, record._fields, clock)
+        self.record = record
+        self._postings = {}
+        self._words = []
+
+    def row_words(self, row) -> set:
+        """Returns the words of the searched columns of a row"""
+        return {word for name in self.model.SEARCH_KEYS for word in search_words(getattr(row, name))}
+
+    def _entry(self, row):
+        return self.record._make(row)
+
+    def _build(self, entries) -> tuple:
+        rows = {}
+        postings = {}
+        for row in entries:
+            rows[row.id] = row
+            for word in self.row_words(row):
+                postings.setdefault(word, set()).add(row.id)
+        return rows, (postings, sorted(postings))
+
+    def _install(self, state):
+        self._postings, self._words = state
+
+    def _add(self, entry):
+        for word in self.row_words(entry):
+            ids = self._postings.get(word)
+            if ids is None:
+                ids = self._postings[word] = set()
+                insort(self._words, word)
+            ids.add(entry.id)
+
+    def _remove(self, entry):
+        for word in self.row_words(entry):
+            ids = self._postings[word]
+            ids.discard(entry.id)
+            if not ids:
+                del self._postings[word]
+                del self._words[bisect_left(self._words, word)]
+
+    def _prefixed(self, prefix: str):
+        """Yields the indexed words starting with a prefix"""
+        for position in range(bisect_left(self._words, prefix), len(self._words)):
+            word = self._words[position]
+            if not word.startswith(prefix):
+                return
+            yield word
+
+    def find(self, words: list, limit: int) -> list:
+        """Returns the records holding a word starting with each of the words
+
+        Records holding more of the words themselves come first, then those
+        with the lowest ids.
+        """
+        with self._lock:
+            scores = None
+            for word in words:
+                matches = {}
+                for indexed in self._prefixed(word):
+                    for row_id in self._postings[indexed]:
+                        if indexed == word or row_id not in matches:
+                            matches[row_id] = int(indexed == word)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {row_id: score + matches[row_id] for row_id, score in scores.items() if row_id in matches}
+                if not scores:
+                    return []
+            best = heapq.nsmallest(limit, scores, key=lambda row_id: (-scores[row_id], row_id))
+            return [self._rows[row_id] for row_id in best]
+
+
+class NameEntry(namedtuple("NameEntry", "key name id")):
+    """The lowercase name, name and id of a row, all that completing its name takes"""
+    __slots__ = ()
+
+    def serialize(self) -> dict:
+        """Serializes a NameEntry into a dictionary of its id and name"""
+        return {"id": self.id, "name": self.name}
+
+
+class NameIndex(RowIndex):
+    """
+    Class that represents the names of a model in alphabetical order
+
+    The entries of the names are kept in a sorted list, so the names
+    starting with a prefix are found by bisection.
+    """
+
+    def __init__(self, model, clock=time.monotonic):
+        super().__init__(model, ("id", "name"), clock)
+        self._names = []
+
+    def _entry(self, row):
+        return NameEntry(row.name.lower(), row.name, row.id)
+
+    def _build(self, entries) -> tuple:
+        rows = {entry.id: entry for entry in entries}
+        return rows, sorted(rows.values())
+
+    def _install(self, state):
+        self._names = state
+
+    def _add(self, entry):
+        insort(self._names, entry)
+
+    def _remove(self, entry):
+        del self._names[bisect_left(self._names, entry)]
+
+    def complete(self, prefix: str, limit: int) -> list:
+        """Returns the entries of the names starting with a prefix, in alphabetical order"""
+        prefix = prefix.lower()
+        with self._lock:
+            entries = []
+            for position in range(bisect_left(self._names, (prefix,)), len(self._names)):
+                entry = self._names[position]
+                if len(entries) == limit or not entry.key.startswith(prefix):
+                    break
+                entries.append(entry)
+            return entries
+
+
+supplier_index = WordIndex(Supplier, SupplierRecord)
+item_index = WordIndex(Item, ItemRecord)
+supplier_names = NameIndex(Supplier)
+item_names = NameIndex(Item)
+supplier_copies.extend([supplier_index, supplier_names])
+item_copies.extend([item_index, item_names])
+
+
+def search_backend() -> str:
+    """Returns the search backend, fulltext or memory, picked by the SEARCH_BACKEND setting"""
+    return current_app.config.get("SEARCH_BACKEND", "fulltext")
+
+
+def search(text: str, limit: int = 20) -> dict:
+    """Returns the Suppliers and the Items best matching the words of a text
+
+    Every word of the text must start a word of the name or address of a
+    Supplier, or of the name of an Item.
+
+    :param text: the words to search for
+    :type text: str
+    :param limit: the number of Suppliers and of Items to return at most
+    :type limit: int
+
+    :return: the matching SupplierRecords and ItemRecords, best first
+    :rtype: dict
+
+    """
+    words = search_words(text)
+    if not words:
+        return {"suppliers": [], "items": []}
+    if search_backend() == "fulltext":
+        return {"suppliers": Supplier.search(words, limit), "items": Item.search(words, limit)}
+    ttl = current_app.config["SEARCH_INDEX_TTL"]
+    results = {}
+    for name, index in (("suppliers", supplier_index), ("items", item_index)):
+        index.refresh(ttl)
+        results[name] = index.find(words, limit)
+    return results
+
+
+def autocomplete(names: NameIndex, prefix: str, limit: int = 10) -> list:
+    """Returns the entries of an index whose name starts with a prefix, case insensitively
+
+    :param names: the supplier_names or the item_names
+    :type names: NameIndex
+    :param prefix: the start of the names
+    :type prefix: str
+    :param limit: the number of records to return at most
+    :type limit: int
+
+    :return: the matching NameEntries in alphabetical order of their names
+    :rtype: list
+
+    """
+    names.refresh(current_app.config["SEARCH_INDEX_TTL"])
+    return names.complete(prefix, limit)
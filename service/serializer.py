@@ -0,0 +1,84 @@
+# Copyright 2016, 2021 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Module: serializer
+
+Serializes query rows to the JSON that flask-restx marshalling would
+produce for the same model, without building an intermediate dict per
+model instance or walking the model fields for every row.
+"""
+import json
+from flask import current_app
+from flask_restx import fields
+
+# Formats equivalent to those of the flask-restx fields for any non None value
+FORMATS = {
+    fields.String: str,
+    fields.Integer: int,
+    fields.Float: float,
+}
+
+
+def output_settings() -> dict:
+    """Returns the json.dumps() settings flask-restx uses for the current app"""
+    settings = dict(current_app.config.get("RESTX_JSON", {}))
+    if current_app.debug:
+        settings.setdefault("indent", 4)
+    return settings
+
+
+class Serializer:
+    """
+    Class that represents a flask-restx model compiled into a serializer
+
+    The model is compiled once into a function that builds the marshalled
+    dict of a row straight from the tuple of its column values, such as a
+    SupplierRecord or a row of Supplier.project().
+    """
+
+    def __init__(self, model, record):
+        # inherited models only list their own fields, resolved has all of them
+        self.model = getattr(model, "resolved", model)
+        self.record = record
+        self.keys = list(self.model)
+        self.to_dict = self._compile()
+
+    def _compile(self):
+        """Returns a function from the tuple of a row's values to its marshalled dict"""
+        namespace = {}
+        names = [f"value_{index}" for index in range(len(self.record._fields))]
+        items = []
+        for index, key in enumerate(self.keys):
+            field = self.model[key]
+            name = names[self.record._fields.index(field.attribute or key)]
+            default = field.default
+            namespace[f"format_{index}"] = FORMATS.get(type(field), field.format)
+            namespace[f"default_{index}"] = field.format(default) if default else default
+            items.append(f"{key!r}: default_{index} if {name} is None else format_{index}({name})")
+        unpack = ", ".join(names) + ("," if len(names) == 1 else "")
+        source = f"def to_dict(row):\n    {unpack} = row\n    return {{{', '.join(items)}}}\n"
+        exec(source, namespace)  # pylint: disable=exec-used
+        return namespace["to_dict"]
+
+    def dumps(self, rows) -> str:
+        """Returns the JSON list of the rows exactly as flask-restx sends a marshalled list"""
+        return json.dumps([self.to_dict(row) for row in rows], **output_settings()) + "\n"
+
+    def dumps_one(self, row) -> str:
+        """Returns the JSON of a row exactly as flask-restx sends a marshalled model"""
+        return json.dumps(self.to_dict(row), **output_settings()) + "\n"
+
+    def dumps_row(self, row) -> str:
+        """Returns the JSON of a single row, as sent one line at a time in NDJSON"""
+        return json.dumps(self.to_dict(row))
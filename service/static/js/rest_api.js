@@ -195,6 +195,29 @@ $(function () {
         clear_form_data()
     });
 
+    // ****************************************
+    // Complete the names as they are typed
+    // ****************************************
+
+    function autocomplete_names(input, list, url) {
+        $(input).attr("list", list.substring(1)).after(`<datalist id="${list.substring(1)}"></datalist>`);
+        $(input).on("input", function () {
+            let prefix = $(input).val();
+            if (prefix == "") {
+                return;
+            }
+            $.getJSON(url, {prefix: prefix, limit: 10}, function (res) {
+                $(list).empty();
+                for (let row of res) {
+                    $(list).append($("<option>").attr("value", row.name));
+                }
+            });
+        });
+    }
+
+    autocomplete_names("#supplier_name", "#supplier_names", BASE_URL + "/suppliers/autocomplete");
+    autocomplete_names("#item_name", "#item_names", BASE_URL + "/items/autocomplete");
+
     // ****************************************
     // Search for a Supplier
     // ****************************************
@@ -218,7 +241,11 @@ $(function () {
             }
         }
         if (address){
-            queryString += 'address=' + address
+            if (queryString.length > 0) {
+                queryString += '&address=' + address
+            } else {
+                queryString += 'address=' + address
+            }
         }
 
         $("#flash_message").empty();
@@ -0,0 +1,43 @@
+"""
+Micro-benchmark of the list serialization paths
+
+Compares Supplier.serialize() followed by flask-restx marshalling, as the
+list endpoints did, with the precompiled Serializer going from
+SupplierRecords to JSON. No rows are read from the database.
+
+  python -m tests.benchmark_serializer [rows] [repeat]
+"""
+import sys
+import timeit
+from flask_restx import marshal
+from flask_restx.representations import output_json
+from service import app
+from service.model import Supplier, SupplierRecord
+from service.route import supplier_model, supplier_serializer
+
+
+def main(count: int = 10000, repeat: int = 5):
+    """Times both paths serializing count Suppliers, best of repeat runs"""
+    suppliers = [
+        Supplier(id=number, name=f"Supplier {number}", available=number % 2 == 0,
+                 address=f"{number} Main Street", rating=number % 50 / 10, version=number)
+        for number in range(count)
+    ]
+    rows = [SupplierRecord(**supplier.serialize()) for supplier in suppliers]
+
+    def marshal_path():
+        data = marshal([supplier.serialize() for supplier in suppliers], supplier_model)
+        return output_json(data, 200).get_data()
+
+    def serializer_path():
+        return supplier_serializer.dumps(rows).encode("utf-8")
+
+    with app.test_request_context():
+        assert marshal_path() == serializer_path()
+        for name, path in (("serialize + marshal", marshal_path), ("Serializer", serializer_path)):
+            best = min(timeit.repeat(path, number=1, repeat=repeat))
+            print(f"{name:>20}: {best * 1000:8.1f} ms for {count} rows, {best / count * 1e6:6.2f} us/row")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))